@@ -0,0 +1,287 @@
+import argparse
+import time
+
+import numpy as np
+
+from features import FEATURE_NAMES, placement_features
+from final_game import (Piece, TetrisGame, ACTION_LEFT, ACTION_RIGHT, ACTION_DOWN, ACTION_ROTATE,
+                        ACTION_DROP, ACTION_RESET)
+from headless import HeadlessRunner
+from search import TranspositionTable, enumerate_placements
+
+WEIGHTS = {
+    "aggregate_height": -0.510066,
+    "holes": -0.35663,
+    "bumpiness": -0.184483,
+    "completed_lines": 0.760666,
+}
+DEFAULT_WEIGHTS = np.array([WEIGHTS.get(name, 0.0) for name in FEATURE_NAMES], dtype=np.float32)
+LOSS = -1e9
+BUDGET_MS = 2.0
+TABLE_CAPACITY = 1 << 8
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class _CostEstimate:
+    __slots__ = ("mean", "deviation")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.deviation = 0.0
+
+    @property
+    def bound(self):
+        return self.mean + 4 * self.deviation
+
+    def update(self, elapsed):
+        self.deviation += (abs(elapsed - self.mean) - self.deviation) * 0.25
+        self.mean += (elapsed - self.mean) * 0.125
+
+
+class AutoPlayer:
+    def __init__(self, weights=DEFAULT_WEIGHTS, budget_ms=BUDGET_MS, beam_width=4, preview=1,
+                 actions_per_frame=1, auto_restart=False):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.line_weight = float(self.weights[FEATURE_NAMES.index("completed_lines")])
+        self.budget = budget_ms / 1000
+        self.beam_width = beam_width
+        self.preview = preview
+        self.actions_per_frame = actions_per_frame
+        self.auto_restart = auto_restart
+        self.enabled = True
+        self.table = TranspositionTable(TABLE_CAPACITY, policy="lru")
+        self.moves = 0
+        self.nodes = 0
+        self.search_time = 0.0
+        self.max_search_time = 0.0
+        self.depth_total = 0
+        self.last_depth = 0
+        self._eval_cost = _CostEstimate()
+        self._expand_cost = _CostEstimate()
+        self._deadline = float("inf")
+        self._plan_key = None
+        self._target = None
+        self._path = ()
+        self._step = 0
+        self._expected = None
+
+    def _score(self, grid, piece, placements):
+        self.nodes += len(placements)
+        return placement_features(grid, piece, placements) @ self.weights
+
+    def _check(self, cost):
+        if time.perf_counter() + cost.bound > self._deadline:
+            raise _OutOfTime
+
+    def _evaluate(self, grid, shape_idx, required=False):
+        key = (grid.hash, shape_idx)
+        entry = self.table.get(key)
+        if entry is None:
+            if not required:
+                self._check(self._eval_cost)
+            start = time.perf_counter()
+            piece = Piece(shape_idx, grid.width)
+            placements = enumerate_placements(grid, piece, None)
+            values = self._score(grid, piece, placements) if placements else None
+            entry = (piece, placements, values)
+            self.table.put(key, entry)
+            self._eval_cost.update(time.perf_counter() - start)
+        return entry
+
+    def _best_value(self, grid, shape_idx):
+        values = self._evaluate(grid, shape_idx)[2]
+        return LOSS if values is None else float(values.max())
+
+    def _expand(self, candidates):
+        beam = []
+        for value, root, grid, piece, placement, lines in sorted(candidates, key=lambda c: -c[0])[:self.beam_width]:
+            self._check(self._expand_cost)
+            start = time.perf_counter()
+            child = grid.clone()
+            piece = piece.copy()
+            piece.rotation, piece.x, piece.y = placement.rotation, placement.x, placement.y
+            beam.append((root, child, lines + child.place_piece(piece)))
+            self._expand_cost.update(time.perf_counter() - start)
+        return beam
+
+    def search(self, game, start=None):
+        if start is None:
+            start = time.perf_counter()
+        grid = game.grid
+        piece = game.current_piece
+        spawn = Piece(piece.shape_idx, grid.width)
+        if (piece.rotation, piece.x, piece.y) == (spawn.rotation, spawn.x, spawn.y):
+            piece, placements, values = self._evaluate(grid, piece.shape_idx, required=True)
+        else:
+            placements = enumerate_placements(grid, piece, None)
+            values = self._score(grid, piece, placements) if placements else None
+        if not placements:
+            return None
+        best = int(values.argmax())
+        depth = 1
+
+        upcoming = [game.next_piece.shape_idx, *map(int, game.upcoming(max(self.preview - 1, 0)))]
+        pieces = upcoming[:self.preview]
+        self._deadline = start + self.budget
+        try:
+            beam = self._expand([(values[i], i, grid, piece, placements[i], 0)
+                                 for i in range(len(placements))])
+            for layer in range(len(pieces) + 1):
+                results = []
+                candidates = []
+                last = layer == len(pieces)
+                for root, child, lines in beam:
+                    if last:
+                        value = sum(self._best_value(child, shape) for shape in range(len(Piece.SHAPES)))
+                        value /= len(Piece.SHAPES)
+                    else:
+                        child_piece, child_placements, child_values = self._evaluate(child, pieces[layer])
+                        value = LOSS if child_values is None else float(child_values.max())
+                        if child_values is not None:
+                            candidates.extend((v + self.line_weight * lines, root, child, child_piece,
+                                               placement, lines)
+                                              for v, placement in zip(child_values, child_placements))
+                    results.append((value + self.line_weight * lines, root))
+                if results:
+                    best = max(results)[1]
+                    depth = layer + 2
+                if last or not candidates:
+                    break
+                beam = self._expand(candidates)
+        except _OutOfTime:
+            pass
+        finally:
+            self._deadline = float("inf")
+
+        elapsed = time.perf_counter() - start
+        self.moves += 1
+        self.search_time += elapsed
+        self.max_search_time = max(self.max_search_time, elapsed)
+        self.depth_total += depth
+        self.last_depth = depth
+        return placements[best]
+
+    def play(self, game):
+        if not self.enabled:
+            return
+        if game.game_over:
+            if self.auto_restart:
+                game.apply_action(ACTION_RESET)
+            return
+        start = time.perf_counter()
+        piece = game.current_piece
+        key = game.sequence.position
+        if key != self._plan_key:
+            self._plan_key = key
+            self._plan(game, start)
+        elif (piece.rotation, piece.x, piece.y) != self._expected:
+            if not self._reroute(game):
+                self._plan(game, start)
+            self.max_search_time = max(self.max_search_time, time.perf_counter() - start)
+
+        count = self.actions_per_frame or len(self._path)
+        while count and self._step < len(self._path):
+            action = self._path[self._step]
+            self._step += 1
+            count -= 1
+            game.apply_action(action)
+            if action == ACTION_DROP:
+                return
+        self._expected = (piece.rotation, piece.x, piece.y)
+
+    def _plan(self, game, start=None):
+        target = self.search(game, start)
+        self._target = None if target is None else self._cells(game.current_piece, target)
+        self._path = (ACTION_DROP,) if target is None else target.path
+        self._step = 0
+
+    def _reroute(self, game):
+        if self._target is None:
+            return False
+        if self._replay(game):
+            return True
+        piece = game.current_piece
+        for placement in enumerate_placements(game.grid, piece, None):
+            if self._cells(piece, placement) == self._target:
+                self._path = placement.path
+                self._step = 0
+                return True
+        return False
+
+    def _replay(self, game):
+        grid = game.grid
+        piece = game.current_piece.copy()
+        for action in self._path[self._step:]:
+            if action == ACTION_DROP:
+                piece.y += grid.drop_distance(piece)
+                break
+            rotation, x, y = piece.rotation, piece.x, piece.y
+            if action == ACTION_LEFT:
+                x -= 1
+            elif action == ACTION_RIGHT:
+                x += 1
+            elif action == ACTION_DOWN:
+                y += 1
+            elif action == ACTION_ROTATE:
+                rotation = piece.rotate()
+            if not grid.is_valid_position(piece, rotation, x, y):
+                return False
+            piece.rotation, piece.x, piece.y = rotation, x, y
+        return frozenset(piece.get_blocks()) == self._target
+
+    @staticmethod
+    def _cells(piece, placement):
+        return frozenset(piece.get_blocks(placement.rotation, placement.x, placement.y))
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.search_time if self.search_time else 0.0
+
+    def metrics(self):
+        return {
+            "moves": self.moves,
+            "nodes": self.nodes,
+            "nodes_per_second": self.nodes_per_second,
+            "mean_depth": self.depth_total / self.moves if self.moves else 0.0,
+            "last_depth": self.last_depth,
+            "mean_search_ms": self.search_time / self.moves * 1000 if self.moves else 0.0,
+            "max_search_ms": self.max_search_time * 1000,
+            "cache_hit_rate": self.table.hit_rate,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Let the built-in autoplayer play Tetris.")
+    parser.add_argument("--games", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=None)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--beam", type=int, default=4)
+    parser.add_argument("--preview", type=int, default=1)
+    parser.add_argument("--watch", action="store_true")
+    args = parser.parse_args()
+
+    if args.watch:
+        player = AutoPlayer(budget_ms=args.budget_ms, beam_width=args.beam, preview=args.preview,
+                            auto_restart=True)
+        TetrisGame(seed=args.seed).run(player=player)
+        return
+
+    for seed in range(args.seed, args.seed + args.games):
+        game = TetrisGame(seed=seed)
+        game.player = AutoPlayer(budget_ms=args.budget_ms, beam_width=args.beam, preview=args.preview,
+                                 actions_per_frame=None)
+        runner = HeadlessRunner(game)
+        runner.run(args.max_ticks)
+        metrics = game.player.metrics()
+        score = game.score_manager
+        print(f"seed {seed}: score {score.score}, lines {score.lines_cleared}, pieces {metrics['moves']}, "
+              f"{metrics['nodes_per_second']:,.0f} nodes/s, depth {metrics['mean_depth']:.2f}, "
+              f"search {metrics['mean_search_ms']:.2f} ms mean / {metrics['max_search_ms']:.2f} ms max")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import numpy as np
+
+from final_game import (COLS, ROWS, Piece, PieceSequence, ACTION_LEFT, ACTION_RIGHT, ACTION_DOWN,
+                        ACTION_ROTATE, ACTION_DROP, ACTION_GRAVITY, ACTION_RESET)
+
+SPAWN_X = np.array([COLS // 2 - states[0].width // 2 for states in Piece.ROTATIONS], dtype=np.int16)
+
+MOVE_DX = np.zeros(ACTION_RESET + 1, dtype=np.int16)
+MOVE_DY = np.zeros(ACTION_RESET + 1, dtype=np.int16)
+MOVE_DROT = np.zeros(ACTION_RESET + 1, dtype=np.int16)
+MOVE_DX[ACTION_LEFT] = -1
+MOVE_DX[ACTION_RIGHT] = 1
+MOVE_DY[ACTION_DOWN] = 1
+MOVE_DY[ACTION_GRAVITY] = 1
+MOVE_DROT[ACTION_ROTATE] = 1
+
+
+class BatchSimulator:
+    def __init__(self, n, seeds=None, randomizer="uniform"):
+        if seeds is None:
+            seeds = range(n)
+        self.n = n
+        self.boards = np.zeros((n, ROWS, COLS), dtype=np.uint8)
+        self.shape = np.zeros(n, dtype=np.int16)
+        self.next_shape = np.zeros(n, dtype=np.int16)
+        self.rotation = np.zeros(n, dtype=np.int16)
+        self.x = np.zeros(n, dtype=np.int16)
+        self.y = np.zeros(n, dtype=np.int16)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.level = np.ones(n, dtype=np.int64)
+        self.lines_cleared = np.zeros(n, dtype=np.int64)
+        self.games_finished = np.zeros(n, dtype=np.int64)
+        self.last_score = np.zeros(n, dtype=np.int64)
+        self._sequences = [PieceSequence(seed, randomizer) for seed in seeds]
+        self.chunk = self._sequences[0].chunk if n else 0
+        self._queues = np.empty((n, self.chunk), dtype=np.uint8)
+        for queue, sequence in zip(self._queues, self._sequences):
+            queue[:] = sequence.peek(self.chunk)
+        self._offsets = np.zeros(n, dtype=np.int64)
+        self.reset()
+
+    def _draw(self, idx):
+        offsets = self._offsets[idx]
+        shapes = self._queues[idx, offsets].astype(np.int16)
+        offsets += 1
+        self._offsets[idx] = offsets
+        for i in idx[offsets == self.chunk].tolist():
+            sequence = self._sequences[i]
+            sequence.seek(sequence.position + self.chunk)
+            self._queues[i] = sequence.peek(self.chunk)
+            self._offsets[i] = 0
+        return shapes
+
+    def _spawn(self, idx, shapes):
+        self.shape[idx] = shapes
+        self.rotation[idx] = 0
+        self.x[idx] = SPAWN_X[shapes]
+        self.y[idx] = 0
+
+    def reset(self, idx=None):
+        if idx is None:
+            idx = np.arange(self.n)
+        self.boards[idx] = 0
+        self.score[idx] = 0
+        self.level[idx] = 1
+        self.lines_cleared[idx] = 0
+        self._spawn(idx, self._draw(idx))
+        self.next_shape[idx] = self._draw(idx)
+
+    def _blocks(self, idx, rotation, x, y):
+        offsets = Piece.OFFSETS[self.shape[idx], rotation]
+        return x[:, None] + offsets[..., 0], y[:, None] + offsets[..., 1]
+
+    def is_valid_position(self, idx, rotation, x, y):
+        bx, by = self._blocks(idx, rotation, x, y)
+        inside = (bx >= 0) & (bx < COLS) & (by < ROWS)
+        occupied = self.boards[idx[:, None], np.clip(by, 0, ROWS - 1), np.clip(bx, 0, COLS - 1)] != 0
+        return (inside & ~(occupied & (by >= 0))).all(axis=1)
+
+    def drop_distance(self, idx):
+        # Each cell falls to the first filled row below it in its column; the piece stops at the nearest.
+        bx, by = self._blocks(idx, self.rotation[idx], self.x[idx], self.y[idx])
+        below = (self.boards[idx[:, None], :, bx] != 0) & (np.arange(ROWS) > by[..., None])
+        floor = np.where(below.any(axis=2), below.argmax(axis=2), ROWS)
+        return (floor - by - 1).min(axis=1).astype(self.y.dtype)
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        idx = np.arange(self.n)
+        rotation = (self.rotation + MOVE_DROT[actions]) % 4
+        x = self.x + MOVE_DX[actions]
+        y = self.y + MOVE_DY[actions]
+        valid = self.is_valid_position(idx, rotation, x, y)
+        self.rotation[valid] = rotation[valid]
+        self.x[valid] = x[valid]
+        self.y[valid] = y[valid]
+
+        falling = np.flatnonzero(actions == ACTION_DROP)
+        if falling.size:
+            self.y[falling] += self.drop_distance(falling)
+
+        lock = np.flatnonzero((actions == ACTION_DROP) | ((actions == ACTION_GRAVITY) & ~valid))
+        cleared = np.zeros(self.n, dtype=np.int64)
+        done = np.zeros(self.n, dtype=bool)
+        if lock.size:
+            cleared[lock] = self._lock(lock)
+            done[lock] = self._next_piece(lock)
+        resets = np.flatnonzero(actions == ACTION_RESET)
+        if resets.size:
+            self.reset(resets)
+        return cleared, done
+
+    def _lock(self, idx):
+        bx, by = self._blocks(idx, self.rotation[idx], self.x[idx], self.y[idx])
+        self.boards[idx[:, None], by, bx] = (self.shape[idx] + 1)[:, None]
+
+        full = (self.boards[idx] != 0).all(axis=2)
+        cleared = full.sum(axis=1)
+        hit = cleared > 0
+        if hit.any():
+            rows = idx[hit]
+            order = np.argsort(~full[hit], axis=1, kind="stable")
+            boards = np.take_along_axis(self.boards[rows], order[:, :, None], axis=1)
+            boards[np.arange(ROWS)[None, :] < cleared[hit][:, None]] = 0
+            self.boards[rows] = boards
+
+        self.lines_cleared[idx] += cleared
+        self.score[idx] += cleared * 100 * self.level[idx]
+        self.level[idx] = self.lines_cleared[idx] // 10 + 1
+        return cleared
+
+    def _next_piece(self, idx):
+        self._spawn(idx, self.next_shape[idx])
+        self.next_shape[idx] = self._draw(idx)
+        done = ~self.is_valid_position(idx, self.rotation[idx], self.x[idx], self.y[idx])
+        finished = idx[done]
+        if finished.size:
+            self.last_score[finished] = self.score[finished]
+            self.games_finished[finished] += 1
+            self.reset(finished)
+        return done
@@ -0,0 +1,269 @@
+import copy
+import os
+import random
+import time
+import tracemalloc
+
+import numpy as np
+import pygame
+
+from batch_sim import BatchSimulator
+from features import board_features, placement_boards
+from final_game import (COLS, ROWS, HEIGHT, TOTAL_WIDTH, GRID_BACKENDS, Piece, TetrisGame,
+                        TetrisRenderer, ACTION_DROP, ACTION_GRAVITY)
+from search import enumerate_placements
+
+
+def _collision_queries(count, seed=0):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        piece = Piece(rng.randint(0, len(Piece.SHAPES) - 1))
+        rotation = rng.randint(0, 3)
+        x = rng.randint(-1, COLS - 1)
+        y = rng.randint(0, ROWS - 1)
+        queries.append((piece, rotation, x, y))
+    return queries
+
+
+def _fill_board(grid, seed=0):
+    rng = random.Random(seed)
+    for _ in range(12):
+        piece = Piece(rng.randint(0, len(Piece.SHAPES) - 1))
+        piece.x = rng.randint(0, COLS - piece.state.width)
+        piece.y += grid.drop_distance(piece)
+        grid.place_piece(piece)
+
+
+def bench_grid_backends(queries=20000, games=200):
+    work = _collision_queries(queries)
+    results = {}
+    for name, grid_cls in GRID_BACKENDS.items():
+        grid = grid_cls()
+        _fill_board(grid)
+        start = time.perf_counter()
+        for piece, rotation, x, y in work:
+            grid.is_valid_position(piece, rotation, x, y)
+        collision_time = time.perf_counter() - start
+
+        rng = random.Random(1)
+        placed = 0
+        start = time.perf_counter()
+        for _ in range(games):
+            grid.reset()
+            while True:
+                piece = Piece(rng.randint(0, len(Piece.SHAPES) - 1))
+                piece.x = rng.randint(0, COLS - piece.state.width)
+                if not grid.is_valid_position(piece):
+                    break
+                piece.y += grid.drop_distance(piece)
+                grid.place_piece(piece)
+                placed += 1
+        game_time = time.perf_counter() - start
+        results[name] = (queries / collision_time, placed / game_time)
+
+    base_checks, base_places = results["array"]
+    print(f"{'backend':<10} {'checks/s':>12} {'speedup':>8} {'places/s':>12} {'speedup':>8}")
+    for name, (checks, places) in results.items():
+        print(f"{name:<10} {checks:>12,.0f} {checks / base_checks:>7.1f}x "
+              f"{places:>12,.0f} {places / base_places:>7.1f}x")
+    return results
+
+
+def bench_drop_distance(queries=20000):
+    pieces = [piece for piece, _, _, _ in _collision_queries(queries)]
+    for piece in pieces:
+        piece.x = min(max(piece.x, 0), COLS - piece.state.width)
+    results = {}
+    for name, grid_cls in GRID_BACKENDS.items():
+        grid = grid_cls()
+        _fill_board(grid)
+        timings = []
+        for drop in (grid._scan_drop, grid.drop_distance):
+            start = time.perf_counter()
+            for piece in pieces:
+                drop(piece)
+            timings.append(queries / (time.perf_counter() - start))
+        results[name] = timings
+        print(f"{name:<10} scan {timings[0]:>12,.0f} drops/s   skyline {timings[1]:>12,.0f} drops/s  "
+              f"{timings[1] / timings[0]:>6.1f}x")
+    return results
+
+
+def bench_batch_sim(boards=4096, steps=300, seed=0):
+    rng = np.random.default_rng(seed)
+    actions = rng.integers(0, ACTION_GRAVITY + 1, size=(steps, boards))
+
+    game = TetrisGame(seed=seed)
+    start = time.perf_counter()
+    for action in actions[:, 0]:
+        game.apply_action(int(action))
+        if game.game_over:
+            game.reset()
+    single_rate = steps / (time.perf_counter() - start)
+
+    sim = BatchSimulator(boards, seeds=range(boards))
+    start = time.perf_counter()
+    for step_actions in actions:
+        sim.step(step_actions)
+    elapsed = time.perf_counter() - start
+    batch_rate = steps * boards / elapsed
+    print(f"TetrisGame      {single_rate:>12,.0f} board-steps/s")
+    print(f"BatchSimulator  {batch_rate:>12,.0f} board-steps/s  {batch_rate / single_rate:>6.1f}x  "
+          f"{sim.games_finished.sum() / elapsed:,.0f} games/s")
+    return single_rate, batch_rate
+
+
+def bench_snapshot(iterations=20000, seed=0):
+    game = TetrisGame(seed=seed)
+    game.game_state = "playing"
+    rng = random.Random(seed)
+    for _ in range(40):
+        game.apply_action(rng.randint(1, 5))
+        if game.game_over:
+            game.reset()
+    rates = {}
+    start = time.perf_counter()
+    for _ in range(iterations // 10):
+        copy.deepcopy(game)
+    rates["deepcopy"] = iterations // 10 / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        snapshot = game.snapshot()
+    rates["snapshot"] = iterations / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        game.restore(snapshot)
+    rates["restore"] = iterations / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        game.clone()
+    rates["clone"] = iterations / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        game.clone().apply_action(ACTION_DROP)
+    rates["clone+drop"] = iterations / (time.perf_counter() - start)
+    for name, rate in rates.items():
+        print(f"{name:<15} {rate:>12,.0f} /s  {rate / rates['deepcopy']:>6.1f}x")
+    print(f"snapshot size   {len(snapshot):>12} bytes")
+    return rates
+
+
+def bench_render(frames=600, seed=0):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    screen = pygame.display.set_mode((TOTAL_WIDTH, HEIGHT))
+    rates = {}
+    for compositing in (False, True):
+        game = TetrisGame(seed=seed)
+        game.game_state = "playing"
+        renderer = TetrisRenderer(game.colors, compositing)
+        start = time.perf_counter()
+        for frame in range(frames):
+            game.update(1000 // 60)
+            if game.game_over:
+                game.reset()
+            renderer.render(screen, game)
+        rates[compositing] = frames / (time.perf_counter() - start)
+    pygame.quit()
+    print(f"render          {rates[False]:>12,.0f} frames/s")
+    print(f"render (comp.)  {rates[True]:>12,.0f} frames/s  {rates[True] / rates[False]:>6.1f}x")
+    return rates
+
+
+def bench_features(iterations=2000, seed=0):
+    game = TetrisGame(seed=seed)
+    _fill_board(game.grid, seed)
+    piece = game.current_piece
+    placements = enumerate_placements(game.grid, piece, None)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        board_features(placement_boards(game.grid, piece, placements))
+    elapsed = time.perf_counter() - start
+    print(f"features        {iterations * len(placements) / elapsed:>12,.0f} boards/s  "
+          f"{elapsed / iterations * 1e6:,.0f} us per {len(placements)}-placement batch")
+    return elapsed / iterations
+
+
+def bench_large_board(width=64, height=10000, placements=2000, seed=0):
+    results = {}
+    print(f"{width}x{height} board")
+    for name, grid_cls in GRID_BACKENDS.items():
+        game = TetrisGame(grid_cls, seed=seed, width=width, height=height)
+        game.game_state = "playing"
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        for _ in range(placements):
+            for _ in range(rng.randint(0, width // 2)):
+                game.apply_action(rng.randint(1, 2))
+            game.apply_action(ACTION_DROP)
+        place_rate = placements / (time.perf_counter() - start)
+        grid = game.grid
+        top = grid.top
+        start = time.perf_counter()
+        for _ in range(placements):
+            grid.region(top, top + ROWS)
+        region_rate = placements / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(placements // 10):
+            game.clone().apply_action(ACTION_DROP)
+        clone_rate = placements // 10 / (time.perf_counter() - start)
+        results[name] = (place_rate, region_rate, clone_rate)
+        print(f"{name:<10} {place_rate:>10,.0f} places/s  {region_rate:>10,.0f} viewports/s  "
+              f"{clone_rate:>8,.0f} clone+drop/s  stack {grid.height - top} rows")
+    return results
+
+
+def bench_idle(seconds=3.0, seed=0):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    results = {}
+    for state in ("start", "playing"):
+        for idle in (False, True):
+            game = TetrisGame(seed=seed)
+            game.game_state = state
+            pygame.init()
+            pygame.time.set_timer(pygame.QUIT, int(seconds * 1000), 1)
+            wall, cpu = time.perf_counter(), time.process_time()
+            game.run(idle=idle)
+            load = (time.process_time() - cpu) / (time.perf_counter() - wall)
+            results[state, idle] = load
+            print(f"{state + (' idle' if idle else ''):<15} {load:>12.1%} cpu")
+    return results
+
+
+def bench_memory(games=1000, placements=20000, seed=0):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    kept = [TetrisGame(seed=seed + i) for i in range(games)]
+    per_game = (tracemalloc.get_traced_memory()[0] - base) / games
+    del kept
+
+    game = TetrisGame(seed=seed)
+    game.game_state = "playing"
+    rng = random.Random(seed)
+    transient = 0
+    for _ in range(placements):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        game.apply_action(rng.randint(1, 2))
+        game.apply_action(ACTION_DROP)
+        transient += tracemalloc.get_traced_memory()[1] - current
+        if game.game_over:
+            game.reset()
+    tracemalloc.stop()
+    print(f"memory per game {per_game:>12,.0f} bytes")
+    print(f"peak per place  {transient / placements:>12,.0f} bytes  "
+          f"{game.pieces.allocated / placements:.4f} Piece allocations per placement")
+    return per_game, transient / placements
+
+
+if __name__ == "__main__":
+    bench_grid_backends()
+    bench_drop_distance()
+    bench_batch_sim()
+    bench_snapshot()
+    bench_render()
+    bench_features()
+    bench_large_board()
+    bench_idle()
+    bench_memory()
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from autoplay import AutoPlayer
+from final_game import COLS, ROWS, TetrisGame, ACTION_RESET
+from headless import HeadlessRunner, RandomInput
+
+MANIFEST = "manifest.json"
+SHARD_SIZE = 1 << 20
+BUFFER_SIZE = 4096
+
+
+def transition_dtype(rows=ROWS, cols=COLS):
+    return np.dtype([
+        ("board", np.uint8, ((rows * cols + 7) // 8,)),
+        ("piece", np.uint8),
+        ("rotation", np.uint8),
+        ("x", np.int16 if cols > 127 else np.int8),
+        ("y", np.int32 if rows > 127 else np.int8),
+        ("next_piece", np.uint8),
+        ("action", np.uint8),
+        ("reward", np.float32),
+        ("done", np.bool_),
+    ])
+
+
+TRANSITION_DTYPE = transition_dtype()
+
+
+def pack_board(cells):
+    return np.packbits(np.asarray(cells).ravel() != 0)
+
+
+def unpack_boards(packed, rows=ROWS, cols=COLS):
+    packed = np.asarray(packed)
+    bits = np.unpackbits(packed, axis=-1, count=rows * cols)
+    return bits.reshape(packed.shape[:-1] + (rows, cols))
+
+
+class DatasetWriter:
+    def __init__(self, directory, shard_size=SHARD_SIZE, rows=ROWS, cols=COLS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.rows = rows
+        self.cols = cols
+        self.dtype = transition_dtype(rows, cols)
+        self.shards = []
+        self.total = 0
+        self._shard = None
+        self._filled = 0
+        self._buffer = np.zeros(BUFFER_SIZE, dtype=self.dtype)
+        self._buffered = 0
+
+    def append(self, board, piece, rotation, x, y, next_piece, action, reward, done):
+        self._buffer[self._buffered] = (board, piece, rotation, x, y, next_piece, action, reward, done)
+        self._buffered += 1
+        if self._buffered == BUFFER_SIZE:
+            self._drain()
+
+    def _drain(self):
+        start = 0
+        while start < self._buffered:
+            if self._shard is None or self._filled == self.shard_size:
+                self._open_shard()
+            count = min(self._buffered - start, self.shard_size - self._filled)
+            self._shard[self._filled:self._filled + count] = self._buffer[start:start + count]
+            self._filled += count
+            self.shards[-1]["count"] = self._filled
+            start += count
+        self.total += self._buffered
+        self._buffered = 0
+
+    def _open_shard(self):
+        if self._shard is not None:
+            self._shard.flush()
+        name = f"shard-{len(self.shards):05d}.npy"
+        self._shard = np.lib.format.open_memmap(os.path.join(self.directory, name), mode="w+",
+                                                dtype=self.dtype, shape=(self.shard_size,))
+        self._filled = 0
+        self.shards.append({"file": name, "count": 0})
+
+    def close(self):
+        self._drain()
+        if self._shard is not None:
+            self._shard.flush()
+            self._shard = None
+        manifest = {
+            "version": 1,
+            "rows": self.rows,
+            "cols": self.cols,
+            "dtype": np.lib.format.dtype_to_descr(self.dtype),
+            "total": self.total,
+            "shards": self.shards,
+        }
+        with open(os.path.join(self.directory, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+
+class TransitionRecorder:
+    def __init__(self, writer, game):
+        if (game.grid.height, game.grid.width) != (writer.rows, writer.cols):
+            raise ValueError(f"Writer expects {writer.cols}x{writer.rows} boards, "
+                             f"got {game.grid.width}x{game.grid.height}")
+        self.writer = writer
+        self.game = game
+        self._pending = None
+        game.recorder = self
+
+    def _finish(self):
+        if self._pending is not None:
+            state, score = self._pending
+            game = self.game
+            self.writer.append(*state, game.score_manager.score - score, game.game_over)
+            self._pending = None
+
+    def record(self, action):
+        self._finish()
+        if action == ACTION_RESET:
+            return
+        game = self.game
+        piece = game.current_piece
+        state = (pack_board(game.grid.cells), piece.shape_idx, piece.rotation, piece.x, piece.y,
+                 game.next_piece.shape_idx, action)
+        self._pending = (state, game.score_manager.score)
+
+    def advance(self):
+        self._finish()
+
+    def close(self):
+        self._finish()
+        self.game.recorder = None
+
+
+class DatasetReader:
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.rows = manifest["rows"]
+        self.cols = manifest["cols"]
+        self.dtype = np.lib.format.descr_to_dtype(manifest["dtype"])
+        if self.dtype != transition_dtype(self.rows, self.cols):
+            raise ValueError(f"Manifest dtype does not describe a {self.cols}x{self.rows} board")
+        self.shards = [np.load(os.path.join(directory, shard["file"]), mmap_mode="r")[:shard["count"]]
+                       for shard in manifest["shards"]]
+        if any(shard.dtype != self.dtype for shard in self.shards):
+            raise ValueError("Shard dtype does not match the manifest")
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        shard = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return self.shards[shard][index - self.offsets[shard]]
+
+    def sample(self, batch_size, rng=None):
+        rng = np.random.default_rng(rng)
+        indices = np.sort(rng.integers(0, len(self), batch_size))
+        shards = np.searchsorted(self.offsets, indices, side="right") - 1
+        batch = np.empty(batch_size, dtype=self.dtype)
+        bounds = np.searchsorted(shards, np.arange(len(self.shards) + 1))
+        for shard, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start < stop:
+                batch[start:stop] = self.shards[shard][indices[start:stop] - self.offsets[shard]]
+        return batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or sample (state, action, reward) transition datasets.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record")
+    record.add_argument("directory")
+    record.add_argument("--games", type=int, default=100)
+    record.add_argument("--seed", type=int, default=0)
+    record.add_argument("--player", choices=("random", "auto"), default="random")
+    record.add_argument("--max-ticks", type=int, default=None)
+    record.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    record.add_argument("--cols", type=int, default=COLS)
+    record.add_argument("--rows", type=int, default=ROWS)
+    sample = commands.add_parser("sample")
+    sample.add_argument("directory")
+    sample.add_argument("--batch", type=int, default=256)
+    sample.add_argument("--batches", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        writer = DatasetWriter(args.directory, args.shard_size, args.rows, args.cols)
+        start = time.perf_counter()
+        for seed in range(args.seed, args.seed + args.games):
+            game = TetrisGame(seed=seed, width=args.cols, height=args.rows)
+            if args.player == "auto":
+                game.player = AutoPlayer(budget_ms=0.0, actions_per_frame=None)
+                runner = HeadlessRunner(game)
+            else:
+                runner = HeadlessRunner(game, RandomInput(seed))
+            recorder = TransitionRecorder(writer, game)
+            runner.run(args.max_ticks)
+            recorder.close()
+        writer.close()
+        elapsed = time.perf_counter() - start
+        print(f"wrote {writer.total:,} transitions in {len(writer.shards)} shards, "
+              f"{writer.total / elapsed:,.0f} transitions/s, {writer.dtype.itemsize} bytes each")
+        return
+
+    reader = DatasetReader(args.directory)
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        unpack_boards(reader.sample(args.batch)["board"], reader.rows, reader.cols)
+    elapsed = time.perf_counter() - start
+    print(f"{len(reader):,} transitions; sampled {args.batches * args.batch / elapsed:,.0f} transitions/s "
+          f"in batches of {args.batch}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from autoplay import AutoPlayer
+from final_game import TetrisGame
+from headless import HeadlessRunner, RandomInput
+from stats import GameStats
+
+RESULT_FIELDS = ("score", "lines", "level", "pieces", "ticks", "done")
+DONE = RESULT_FIELDS.index("done")
+CHUNK = 64
+PLAYERS = ("random", "auto")
+
+
+def play_game(seed, player="random", max_ticks=None, budget_ms=0.0, stats=None):
+    game = TetrisGame(seed=seed)
+    game.stats = stats
+    if player == "auto":
+        game.player = AutoPlayer(budget_ms=budget_ms, actions_per_frame=None)
+        runner = HeadlessRunner(game)
+    else:
+        runner = HeadlessRunner(game, RandomInput(seed))
+    runner.run(max_ticks)
+    score = game.score_manager
+    if stats is not None and not game.game_over:
+        stats.record_game(score)
+    return score.score, score.lines_cleared, score.level, game.sequence.position - 2, runner.ticks
+
+
+def _play_chunk(shm_name, games, start, stop, first_seed, player, max_ticks, budget_ms):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    stats = GameStats()
+    try:
+        results = np.ndarray((games, len(RESULT_FIELDS)), dtype=np.int64, buffer=shm.buf)
+        for index in range(start, stop):
+            results[index, :DONE] = play_game(first_seed + index, player, max_ticks, budget_ms, stats)
+            results[index, DONE] = 1
+        del results
+    finally:
+        shm.close()
+    return start, stop, stats.to_dict()
+
+
+def _open_output(path, games):
+    if os.path.exists(path):
+        output = np.load(path, mmap_mode="r+")
+        if output.shape != (games, len(RESULT_FIELDS)):
+            raise ValueError(f"{path} holds {output.shape[0]} games, expected {games}")
+        return output
+    return np.lib.format.open_memmap(path, mode="w+", dtype=np.int64, shape=(games, len(RESULT_FIELDS)))
+
+
+def _stats_path(output):
+    return os.path.splitext(output)[0] + ".stats.json"
+
+
+def _load_stats(output):
+    if output is not None and os.path.exists(_stats_path(output)):
+        with open(_stats_path(output)) as f:
+            data = json.load(f)
+        return GameStats.from_dict(data["stats"]), [tuple(bounds) for bounds in data["chunks"]]
+    return GameStats(), []
+
+
+def _add_chunk(chunks, start, stop):
+    chunks.append((start, stop))
+    chunks.sort()
+    merged = [chunks[0]]
+    for start, stop in chunks[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    chunks[:] = merged
+
+
+def _pending_chunks(done, chunk):
+    edges = np.flatnonzero(np.diff(np.concatenate(([1], done != 0, [1])).astype(np.int8)))
+    return [(start, min(start + chunk, stop))
+            for gap_start, stop in zip(edges[::2].tolist(), edges[1::2].tolist())
+            for start in range(gap_start, stop, chunk)]
+
+
+def _save_stats(output, stats, chunks):
+    path = _stats_path(output)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"chunks": chunks, "stats": stats.to_dict()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def run_farm(games, workers=None, seed=0, chunk=CHUNK, player="random", max_ticks=None, budget_ms=0.0,
+             output=None, progress=None):
+    if player not in PLAYERS:
+        raise ValueError(f"Unknown player: {player}")
+    shape = (games, len(RESULT_FIELDS))
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+    try:
+        results = np.ndarray(shape, dtype=np.int64, buffer=shm.buf)
+        results[:] = 0
+        saved = _open_output(output, games) if output is not None else None
+        stats, chunks = _load_stats(output)
+        if saved is not None:
+            results[:] = saved
+            covered = np.zeros(games, dtype=bool)
+            for start, stop in chunks:
+                covered[start:stop] = True
+            results[~covered, DONE] = 0
+        pending = _pending_chunks(results[:, DONE], chunk)
+        finished = int(results[:, DONE].sum())
+        resumed = finished
+
+        begin = time.perf_counter()
+        executor = ProcessPoolExecutor(workers)
+        try:
+            futures = [executor.submit(_play_chunk, shm.name, games, start, stop, seed, player, max_ticks,
+                                       budget_ms)
+                       for start, stop in pending]
+            for future in as_completed(futures):
+                start, stop, partial = future.result()
+                stats.merge(GameStats.from_dict(partial))
+                if saved is not None:
+                    saved[start:stop] = results[start:stop]
+                    saved.flush()
+                    _add_chunk(chunks, start, stop)
+                    _save_stats(output, stats, chunks)
+                finished += stop - start
+                if progress is not None:
+                    progress(finished, games, (finished - resumed) / (time.perf_counter() - begin))
+        finally:
+            executor.shutdown(cancel_futures=True)
+        final = results.copy()
+        del results
+    finally:
+        shm.close()
+        shm.unlink()
+    return final, stats
+
+
+def summarize(results):
+    done = results[results[:, DONE] == 1]
+    return {name: float(done[:, i].mean()) if len(done) else 0.0
+            for i, name in enumerate(RESULT_FIELDS[:DONE])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many seeded Tetris games across worker processes.")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk", type=int, default=CHUNK)
+    parser.add_argument("--player", choices=PLAYERS, default="random")
+    parser.add_argument("--budget-ms", type=float, default=0.0)
+    parser.add_argument("--max-ticks", type=int, default=None)
+    parser.add_argument("--output", default=None, help="results .npy file; an existing file is resumed")
+    parser.add_argument("--report", default=None, help="write a JSON statistics report to this file")
+    args = parser.parse_args()
+
+    def report(finished, total, rate):
+        print(f"\r{finished}/{total} games, {rate:,.0f} games/s", end="", flush=True)
+
+    workers = args.workers or os.cpu_count()
+    start = time.perf_counter()
+    try:
+        results, stats = run_farm(args.games, workers, args.seed, args.chunk, args.player, args.max_ticks,
+                           args.budget_ms, args.output, report)
+    except KeyboardInterrupt:
+        print("\ninterrupted" + (f"; rerun with --output {args.output} to resume" if args.output else ""))
+        return
+    elapsed = time.perf_counter() - start
+    print()
+    means = ", ".join(f"{name} {value:,.1f}" for name, value in summarize(results).items())
+    print(f"{args.games} games in {elapsed:.2f}s on {workers} workers "
+          f"({args.games / elapsed / workers:,.1f} games/s per worker); mean {means}")
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            f.write(stats.to_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
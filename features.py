@@ -0,0 +1,61 @@
+import numpy as np
+
+from final_game import Piece
+
+FEATURE_NAMES = ("aggregate_height", "max_height", "holes", "bumpiness", "wells",
+                 "row_transitions", "column_transitions", "completed_lines")
+
+
+def placement_boards(grid, piece, placements, top=0):
+    count = len(placements)
+    boards = np.repeat((grid.region(top, grid.height) != 0)[None], count, axis=0)
+    if count:
+        rotation = np.fromiter((placement.rotation for placement in placements), dtype=np.int16, count=count)
+        x = np.fromiter((placement.x for placement in placements), dtype=np.int16, count=count)
+        y = np.fromiter((placement.y - top for placement in placements), dtype=np.int16, count=count)
+        offsets = Piece.OFFSETS[piece.shape_idx, rotation]
+        boards[np.arange(count)[:, None], y[:, None] + offsets[..., 1], x[:, None] + offsets[..., 0]] = True
+    return boards
+
+
+def placement_features(grid, piece, placements):
+    top = min(grid.top, min((placement.y for placement in placements), default=grid.top))
+    top = max(top - 1, 0)
+    return board_features(placement_boards(grid, piece, placements, top), top)
+
+
+def board_features(boards, top=0):
+    occupied = np.asarray(boards) != 0
+    if occupied.ndim == 2:
+        occupied = occupied[None]
+    count, rows, cols = occupied.shape
+    full = occupied.all(axis=2)
+    completed = full.sum(axis=1)
+    if completed.any():
+        order = np.argsort(~full, axis=1, kind="stable")
+        occupied = np.take_along_axis(occupied, order[:, :, None], axis=1)
+        occupied[np.arange(rows)[None, :] < completed[:, None]] = False
+
+    filled = occupied.any(axis=1)
+    heights = np.where(filled, rows - occupied.argmax(axis=1), 0)
+    holes = heights.sum(axis=1) - occupied.sum(axis=(1, 2))
+
+    walls = np.full((count, 1), rows)
+    padded = np.concatenate((walls, heights, walls), axis=1)
+    wells = np.maximum(np.minimum(padded[:, :-2], padded[:, 2:]) - heights, 0)
+
+    wall = np.ones((count, rows, 1), dtype=bool)
+    edges = np.concatenate((wall, occupied, wall), axis=2)
+    floor = np.ones((count, 1, cols), dtype=bool)
+    columns = np.concatenate((occupied, floor), axis=1)
+
+    features = np.empty((count, len(FEATURE_NAMES)), dtype=np.float32)
+    features[:, 0] = heights.sum(axis=1)
+    features[:, 1] = heights.max(axis=1)
+    features[:, 2] = holes
+    features[:, 3] = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+    features[:, 4] = wells.sum(axis=1)
+    features[:, 5] = (edges[:, :, 1:] != edges[:, :, :-1]).sum(axis=(1, 2)) + 2 * top
+    features[:, 6] = (columns[:, 1:] != columns[:, :-1]).sum(axis=(1, 2))
+    features[:, 7] = completed
+    return features
@@ -1,19 +1,61 @@
+import argparse
 import pygame
 import numpy as np
 import random
+import struct
 import sys
+import time
 import traceback
+from collections import OrderedDict
 from abc import ABC, abstractmethod
 
+from profiler import FrameProfiler, PHASE_EVENTS, PHASE_UPDATE, PHASE_PLACE, PHASE_RENDER, PHASE_FLIP
+
 CELL = 30
 COLS, ROWS = 10, 20
+MAX_COLS = 256
 WIDTH, HEIGHT = CELL * COLS, CELL * ROWS
 PREVIEW_WIDTH = 170
+MAX_BOARD_WIDTH = 960
+MIN_CELL = 8
 TOTAL_WIDTH = WIDTH + PREVIEW_WIDTH
 FPS = 60
+PROFILE_REFRESH = 30
+TEXT_CACHE_SIZE = 128
+SEQUENCE_CHUNK = 7 * 512
+SNAPSHOT_HEADER = struct.Struct("<BBiiBQQIId?")
+
+(ACTION_NONE, ACTION_LEFT, ACTION_RIGHT, ACTION_DOWN, ACTION_ROTATE, ACTION_DROP, ACTION_GRAVITY,
+ ACTION_RESET) = range(8)
+EXPOSE_EVENTS = frozenset((pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWSHOWN, pygame.WINDOWRESTORED))
+KEY_ACTIONS = {
+    pygame.K_LEFT: ACTION_LEFT,
+    pygame.K_RIGHT: ACTION_RIGHT,
+    pygame.K_DOWN: ACTION_DOWN,
+    pygame.K_UP: ACTION_ROTATE,
+    pygame.K_SPACE: ACTION_DROP
+}
+
+
+class RotationState:
+    def __init__(self, shape):
+        self.shape = np.ascontiguousarray(shape)
+        self.shape.setflags(write=False)
+        self.height, self.width = self.shape.shape
+        self.cells = tuple((col, row) for row in range(self.height)
+                           for col in range(self.width) if self.shape[row, col])
+        self.row_masks = tuple(sum(1 << col for col in range(self.width) if self.shape[row, col])
+                               for row in range(self.height))
+        self.top = tuple(min(row for dx, row in self.cells if dx == col) for col in range(self.width))
+        self.bottom = tuple(max(row for dx, row in self.cells if dx == col) for col in range(self.width))
+
+
+def _rotation_states(shape):
+    return tuple(RotationState(np.rot90(shape, k=-turns)) for turns in range(4))
 
 
 class Piece:
+    __slots__ = ("shape_idx", "rotation", "x", "y")
     SHAPES = [
         np.array([[1, 1, 1, 1]]),
         np.array([[2, 0, 0], [2, 2, 2]]),
@@ -23,60 +65,581 @@ class Piece:
         np.array([[0, 6, 0], [6, 6, 6]]),
         np.array([[7, 7, 0], [0, 7, 7]])
     ]
+    ROTATIONS = tuple(_rotation_states(shape) for shape in SHAPES)
+    OFFSETS = np.array([[state.cells for state in states] for states in ROTATIONS], dtype=np.int16)
 
-    def __init__(self, shape_idx=None):
+    def __init__(self, shape_idx=None, board_width=COLS):
         if shape_idx is None:
             shape_idx = random.randint(0, len(self.SHAPES) - 1)
-        self.shape = self.SHAPES[shape_idx].copy()
-        self.color = shape_idx + 1
-        self.x = COLS // 2 - self.shape.shape[1] // 2
+        self.spawn(shape_idx, board_width)
+
+    def spawn(self, shape_idx, board_width=COLS):
+        self.shape_idx = shape_idx
+        self.rotation = 0
+        self.x = board_width // 2 - self.ROTATIONS[shape_idx][0].width // 2
         self.y = 0
+        return self
+
+    @property
+    def color(self):
+        return self.shape_idx + 1
+
+    @property
+    def state(self):
+        return self.ROTATIONS[self.shape_idx][self.rotation]
+
+    @property
+    def shape(self):
+        return self.state.shape
 
     def rotate(self):
-        return np.rot90(self.shape, k=-1)
+        return (self.rotation + 1) % 4
 
-    def get_blocks(self, shape=None, x=None, y=None):
-        if shape is None: shape = self.shape
+    def copy(self):
+        piece = Piece.__new__(Piece)
+        piece.shape_idx = self.shape_idx
+        piece.rotation = self.rotation
+        piece.x = self.x
+        piece.y = self.y
+        return piece
+
+    def get_blocks(self, rotation=None, x=None, y=None):
+        if rotation is None: rotation = self.rotation
         if x is None: x = self.x
         if y is None: y = self.y
-        blocks = []
-        for row in range(shape.shape[0]):
-            for col in range(shape.shape[1]):
-                if shape[row, col]:
-                    blocks.append((x + col, y + row, self.color))
-        return blocks
+        color = self.shape_idx + 1
+        return [(x + dx, y + dy, color) for dx, dy in self.ROTATIONS[self.shape_idx][rotation].cells]
 
 
-class Grid:
-    def __init__(self):
-        self.cells = np.zeros((ROWS, COLS), dtype=int)
+class PiecePool:
+    __slots__ = ("board_width", "free", "allocated")
+
+    def __init__(self, board_width=COLS):
+        self.board_width = board_width
+        self.free = []
+        self.allocated = 0
+
+    def acquire(self, shape_idx):
+        if self.free:
+            return self.free.pop().spawn(shape_idx, self.board_width)
+        self.allocated += 1
+        return Piece(shape_idx, self.board_width)
+
+    def release(self, piece):
+        self.free.append(piece)
+
+
+class PieceSequence:
+    MODES = ("uniform", "bag")
+
+    def __init__(self, seed=None, mode="uniform", chunk=SEQUENCE_CHUNK):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown randomizer mode: {mode}")
+        if mode == "bag" and chunk % len(Piece.SHAPES):
+            raise ValueError("Bag chunk size must be a multiple of the number of shapes")
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+        self.mode = mode
+        self.chunk = chunk
+        self.queue = np.empty(2 * chunk, dtype=np.uint8)
+        self.position = 0
+        self._base = -1
+        self._shared = False
+        self.seek(0)
+
+    def clone(self):
+        sequence = PieceSequence.__new__(PieceSequence)
+        sequence.__dict__.update(self.__dict__)
+        sequence._shared = self._shared = True
+        return sequence
+
+    def _own(self):
+        if self._shared:
+            self.queue = self.queue.copy()
+            self._shared = False
+
+    def _fill(self, offset, index):
+        self._own()
+        rng = np.random.default_rng([self.seed, index])
+        shapes = len(Piece.SHAPES)
+        if self.mode == "bag":
+            bags = np.argsort(rng.random((self.chunk // shapes, shapes)), axis=1)
+            self.queue[offset:offset + self.chunk] = bags.ravel()
+        else:
+            self.queue[offset:offset + self.chunk] = rng.integers(0, shapes, size=self.chunk)
+
+    def _offset(self):
+        offset = self.position - self._base * self.chunk
+        if offset >= self.chunk:
+            self._own()
+            self.queue[:self.chunk] = self.queue[self.chunk:]
+            self._base += 1
+            self._fill(self.chunk, self._base + 1)
+            offset -= self.chunk
+        return offset
+
+    def seek(self, position):
+        base = position // self.chunk
+        if base != self._base:
+            self._base = base
+            self._fill(0, base)
+            self._fill(self.chunk, base + 1)
+        self.position = position
+
+    def next(self):
+        offset = self._offset()
+        shape_idx = int(self.queue[offset])
+        self.position += 1
+        return shape_idx
+
+    def peek(self, n=1):
+        if n > self.chunk:
+            raise ValueError(f"Lookahead is limited to {self.chunk} pieces")
+        offset = self._offset()
+        return self.queue[offset:offset + n]
+
+
+ZOBRIST_MASK = (1 << 64) - 1
+# Rows are combined as sum(row_hash * M**row) mod 2**64.  Clearing a row moves
+# everything above it down one row, which multiplies that block by M; an odd M
+# that is 5 mod 8 has order 2**62, so the weights never repeat on a real board.
+ZOBRIST_MULTIPLIER = 0x9E3779B97F4A7C15
+
+_zobrist_rng = random.Random(0x5EED7E7)
+ZOBRIST_COLUMNS = [_zobrist_rng.getrandbits(64) for _ in range(MAX_COLS)]
+ZOBRIST_POWERS = [1]
+
+
+def _extend_zobrist_powers(height):
+    powers = ZOBRIST_POWERS
+    while len(powers) < height:
+        powers.append(powers[-1] * ZOBRIST_MULTIPLIER & ZOBRIST_MASK)
+
+
+class GridBase(ABC):
+    __slots__ = ("width", "height", "version", "heights", "hash", "row_hashes", "_shared", "cells")
+
+    def __init__(self, width=COLS, height=ROWS):
+        if not 4 <= width <= MAX_COLS:
+            raise ValueError(f"Board width must be between 4 and {MAX_COLS} columns")
+        if height < 4:
+            raise ValueError("Board height must be at least 4 rows")
+        self.width = width
+        self.height = height
+        self.version = 0
+        _extend_zobrist_powers(height)
+        self._reset_index()
+
+    def _reset_index(self):
+        self.heights = [0] * self.width
+        self.hash = 0
+        self.row_hashes = [0] * self.height
+        self.version += 1
+        self._shared = False
+
+    def clone(self):
+        grid = self.__class__.__new__(self.__class__)
+        grid.width = self.width
+        grid.height = self.height
+        grid.version = self.version
+        grid.heights = self.heights[:]
+        grid.hash = self.hash
+        grid.row_hashes = self.row_hashes[:]
+        grid.cells = self.cells
+        grid._shared = self._shared = True
+        return grid
+
+    @property
+    def top(self):
+        return self.height - max(self.heights)
+
+    def region(self, top, bottom):
+        return self.cells[top:bottom]
 
-    def is_valid_position(self, piece, shape=None, x=None, y=None):
-        blocks = piece.get_blocks(shape, x, y)
-        for bx, by, _ in blocks:
-            if bx < 0 or bx >= COLS or by >= ROWS:
+    def _hash_piece(self, piece):
+        row_hashes = self.row_hashes
+        delta = 0
+        for dx, dy in piece.state.cells:
+            row = piece.y + dy
+            key = ZOBRIST_COLUMNS[piece.x + dx]
+            delta += ((row_hashes[row] ^ key) - row_hashes[row]) * ZOBRIST_POWERS[row]
+            row_hashes[row] ^= key
+        self.hash = self.hash + delta & ZOBRIST_MASK
+
+    def _hash_clear_row(self, row):
+        row_hashes = self.row_hashes
+        above = 0
+        for i in range(self.top, row):
+            if row_hashes[i]:
+                above += row_hashes[i] * ZOBRIST_POWERS[i]
+        self.hash = self.hash + above * (ZOBRIST_MULTIPLIER - 1) - row_hashes[row] * ZOBRIST_POWERS[row] & ZOBRIST_MASK
+        del row_hashes[row]
+        row_hashes.insert(0, 0)
+
+    def _rehash(self):
+        occupied = self.cells != 0
+        self.row_hashes = [0] * self.height
+        for row, col in zip(*(index.tolist() for index in np.nonzero(occupied))):
+            self.row_hashes[row] ^= ZOBRIST_COLUMNS[col]
+        self.hash = sum(value * ZOBRIST_POWERS[row] for row, value in enumerate(self.row_hashes)) & ZOBRIST_MASK
+
+    def _own(self):
+        if self._shared:
+            self.cells = self.cells.copy()
+            self._shared = False
+
+    @abstractmethod
+    def is_valid_position(self, piece, rotation=None, x=None, y=None):
+        pass
+
+    @abstractmethod
+    def place_piece(self, piece):
+        pass
+
+    @abstractmethod
+    def clear_lines(self, rows=None):
+        pass
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+    @abstractmethod
+    def load(self, cells):
+        pass
+
+    def drop_distance(self, piece):
+        state = piece.state
+        heights = self.heights
+        distance = self.height
+        for dx, bottom in enumerate(state.bottom):
+            gap = self.height - heights[piece.x + dx] - piece.y - bottom - 1
+            if gap < 0:
+                return self._scan_drop(piece)
+            if gap < distance:
+                distance = gap
+        return distance
+
+    def _scan_drop(self, piece):
+        distance = 0
+        while self.is_valid_position(piece, y=piece.y + distance + 1):
+            distance += 1
+        return distance
+
+    def _raise_heights(self, piece):
+        heights = self.heights
+        for dx, top in enumerate(piece.state.top):
+            height = self.height - piece.y - top
+            if height > heights[piece.x + dx]:
+                heights[piece.x + dx] = height
+
+    def _lower_heights(self, full_rows):
+        heights = self.heights
+        cells = self.cells
+        cleared = len(full_rows)
+        for col in range(self.width):
+            height = heights[col] - cleared
+            if self.height - heights[col] == full_rows[0]:
+                while height > 0 and not cells[self.height - height, col]:
+                    height -= 1
+            heights[col] = height
+
+    def _recompute_heights(self):
+        filled = self.cells != 0
+        self.heights = np.where(filled.any(axis=0), self.height - filled.argmax(axis=0), 0).tolist()
+
+    def _shift_down(self, row):
+        cells = self.cells
+        top = self.top
+        if top <= row:
+            cells[top + 1:row + 1] = cells[top:row]
+            cells[top] = 0
+
+
+class Grid(GridBase):
+    __slots__ = ()
+
+    def __init__(self, width=COLS, height=ROWS):
+        super().__init__(width, height)
+        self.cells = np.zeros((height, width), dtype=int)
+
+    def is_valid_position(self, piece, rotation=None, x=None, y=None):
+        if rotation is None: rotation = piece.rotation
+        if x is None: x = piece.x
+        if y is None: y = piece.y
+        cells = self.cells
+        for dx, dy in piece.ROTATIONS[piece.shape_idx][rotation].cells:
+            bx, by = x + dx, y + dy
+            if bx < 0 or bx >= self.width or by >= self.height:
+                return False
+            if by >= 0 and cells[by, bx]:
                 return False
-            if by >= 0 and self.cells[by, bx]:
+        return True
+
+    def place_piece(self, piece):
+        self._own()
+        for bx, by, color in piece.get_blocks():
+            self.cells[by, bx] = color
+        self._raise_heights(piece)
+        self._hash_piece(piece)
+        self.version += 1
+        return self.clear_lines(range(piece.y, piece.y + piece.state.height))
+
+    def clear_lines(self, rows=None):
+        cells = self.cells
+        if rows is None:
+            rows = range(self.top, self.height)
+        full_rows = [row for row in rows if cells[row].all()]
+        if full_rows:
+            self._own()
+        for row in full_rows:
+            self._hash_clear_row(row)
+            self._shift_down(row)
+        if full_rows:
+            self._lower_heights(full_rows)
+        return len(full_rows)
+
+    def reset(self):
+        self.cells = np.zeros((self.height, self.width), dtype=int)
+        self._reset_index()
+
+    def load(self, cells):
+        self._own()
+        top = self.height - len(cells)
+        self.cells[:top] = 0
+        self.cells[top:] = cells
+        self._recompute_heights()
+        self._rehash()
+        self.version += 1
+
+
+class BitboardGrid(GridBase):
+    __slots__ = ("rows",)
+
+    def __init__(self, width=COLS, height=ROWS):
+        super().__init__(width, height)
+        self.rows = [0] * height
+        self.cells = np.zeros((height, width), dtype=np.uint8)
+
+    def is_valid_position(self, piece, rotation=None, x=None, y=None):
+        if rotation is None: rotation = piece.rotation
+        if x is None: x = piece.x
+        if y is None: y = piece.y
+        state = piece.ROTATIONS[piece.shape_idx][rotation]
+        if x < 0 or x + state.width > self.width or y + state.height > self.height:
+            return False
+        rows = self.rows
+        for row, mask in enumerate(state.row_masks, y):
+            if row >= 0 and rows[row] & (mask << x):
                 return False
         return True
 
+    def clone(self):
+        grid = super().clone()
+        grid.rows = self.rows[:]
+        return grid
+
     def place_piece(self, piece):
+        self._own()
+        rows = self.rows
+        for row, mask in enumerate(piece.state.row_masks, piece.y):
+            rows[row] |= mask << piece.x
         for bx, by, color in piece.get_blocks():
             self.cells[by, bx] = color
-        return self.clear_lines()
+        self._raise_heights(piece)
+        self._hash_piece(piece)
+        self.version += 1
+        return self.clear_lines(range(piece.y, piece.y + piece.state.height))
 
-    def clear_lines(self):
-        non_full_rows = self.cells[np.any(self.cells == 0, axis=1)]
-        cleared = ROWS - non_full_rows.shape[0]
-        new_rows = np.zeros((cleared, COLS), dtype=int)
-        self.cells = np.vstack([new_rows, non_full_rows])
-        return cleared
+    def clear_lines(self, rows=None):
+        bits = self.rows
+        if rows is None:
+            rows = range(self.top, self.height)
+        full_row = (1 << self.width) - 1
+        full_rows = [row for row in rows if bits[row] == full_row]
+        if full_rows:
+            self._own()
+        for row in full_rows:
+            self._hash_clear_row(row)
+            del bits[row]
+            bits.insert(0, 0)
+            self._shift_down(row)
+        if full_rows:
+            self._lower_heights(full_rows)
+        return len(full_rows)
 
     def reset(self):
-        self.cells = np.zeros((ROWS, COLS), dtype=int)
+        self.rows = [0] * self.height
+        self.cells = np.zeros((self.height, self.width), dtype=np.uint8)
+        self._reset_index()
+
+    def load(self, cells):
+        self._own()
+        top = self.height - len(cells)
+        self.cells[:top] = 0
+        self.cells[top:] = cells
+        self.rows = [int.from_bytes(row.tobytes(), "little")
+                     for row in np.packbits(self.cells != 0, axis=1, bitorder="little")]
+        self._recompute_heights()
+        self._rehash()
+        self.version += 1
+
+
+class SparseGrid(GridBase):
+    __slots__ = ("stack", "colors", "_blank")
+
+    def __init__(self, width=COLS, height=ROWS):
+        super().__init__(width, height)
+        self._blank = bytes(width)
+        self.stack = []
+        self.colors = []
+
+    def _reset_index(self):
+        self.heights = [0] * self.width
+        self.hash = 0
+        self.row_hashes = []
+        self.version += 1
+
+    @property
+    def cells(self):
+        return self.region(0, self.height)
+
+    def region(self, top, bottom):
+        bottom = min(bottom, self.height)
+        region = np.zeros((bottom - top, self.width), dtype=np.uint8)
+        low, high = self.height - bottom, min(self.height - top, len(self.colors))
+        if low < high:
+            rows = np.frombuffer(b"".join(reversed(self.colors[low:high])), dtype=np.uint8)
+            region[self.height - high - top:] = rows.reshape(high - low, self.width)
+        return region
+
+    def clone(self):
+        grid = self.__class__.__new__(self.__class__)
+        grid.width = self.width
+        grid.height = self.height
+        grid.version = self.version
+        grid.heights = self.heights[:]
+        grid.hash = self.hash
+        grid.row_hashes = self.row_hashes[:]
+        grid.stack = self.stack[:]
+        grid.colors = self.colors[:]
+        grid._blank = self._blank
+        return grid
+
+    def is_valid_position(self, piece, rotation=None, x=None, y=None):
+        if rotation is None: rotation = piece.rotation
+        if x is None: x = piece.x
+        if y is None: y = piece.y
+        state = piece.ROTATIONS[piece.shape_idx][rotation]
+        if x < 0 or x + state.width > self.width or y + state.height > self.height:
+            return False
+        stack = self.stack
+        depth = self.height - 1 - y
+        for mask in state.row_masks:
+            if depth < len(stack) and stack[depth] & (mask << x):
+                return False
+            depth -= 1
+        return True
+
+    def place_piece(self, piece):
+        state = piece.state
+        stack, colors, row_hashes = self.stack, self.colors, self.row_hashes
+        depth = self.height - 1 - piece.y
+        while len(stack) <= depth:
+            stack.append(0)
+            colors.append(self._blank)
+            row_hashes.append(0)
+        color = piece.shape_idx + 1
+        delta = 0
+        for dy, mask in enumerate(state.row_masks):
+            row = bytearray(colors[depth - dy])
+            key = 0
+            for dx in range(state.width):
+                if mask >> dx & 1:
+                    row[piece.x + dx] = color
+                    key ^= ZOBRIST_COLUMNS[piece.x + dx]
+            stack[depth - dy] |= mask << piece.x
+            colors[depth - dy] = bytes(row)
+            delta += ((row_hashes[depth - dy] ^ key) - row_hashes[depth - dy]) * ZOBRIST_POWERS[piece.y + dy]
+            row_hashes[depth - dy] ^= key
+        self.hash = self.hash + delta & ZOBRIST_MASK
+        self._raise_heights(piece)
+        self.version += 1
+        return self.clear_lines(range(piece.y, piece.y + state.height))
+
+    def _hash_clear_row(self, row):
+        row_hashes = self.row_hashes
+        depth = self.height - 1 - row
+        above = 0
+        for i in range(depth + 1, len(row_hashes)):
+            if row_hashes[i]:
+                above += row_hashes[i] * ZOBRIST_POWERS[self.height - 1 - i]
+        self.hash = self.hash + above * (ZOBRIST_MULTIPLIER - 1) - row_hashes[depth] * ZOBRIST_POWERS[row] & ZOBRIST_MASK
+        del row_hashes[depth]
+
+    def _lower_heights(self, full_rows):
+        heights = self.heights
+        stack = self.stack
+        cleared = len(full_rows)
+        for col in range(self.width):
+            height = heights[col] - cleared
+            if self.height - heights[col] == full_rows[0]:
+                bit = 1 << col
+                while height > 0 and not stack[height - 1] & bit:
+                    height -= 1
+            heights[col] = height
+
+    def clear_lines(self, rows=None):
+        stack = self.stack
+        if rows is None:
+            rows = range(self.top, self.height)
+        full_row = (1 << self.width) - 1
+        full_rows = [row for row in rows
+                     if self.height - 1 - row < len(stack) and stack[self.height - 1 - row] == full_row]
+        for row in full_rows:
+            self._hash_clear_row(row)
+            del stack[self.height - 1 - row]
+            del self.colors[self.height - 1 - row]
+        if full_rows:
+            while stack and not stack[-1]:
+                stack.pop()
+                self.colors.pop()
+                self.row_hashes.pop()
+            self._lower_heights(full_rows)
+        return len(full_rows)
+
+    def reset(self):
+        self.stack = []
+        self.colors = []
+        self._reset_index()
+
+    def load(self, cells):
+        cells = np.asarray(cells, dtype=np.uint8)
+        occupied = cells.any(axis=1)
+        if not occupied.any():
+            self.reset()
+            return
+        rows = cells[int(occupied.argmax()):][::-1]
+        filled = rows != 0
+        self.colors = [row.tobytes() for row in rows]
+        self.stack = [int.from_bytes(bits.tobytes(), "little")
+                      for bits in np.packbits(filled, axis=1, bitorder="little")]
+        self.heights = np.where(filled.any(axis=0), len(rows) - filled[::-1].argmax(axis=0), 0).tolist()
+        self.row_hashes = [0] * len(rows)
+        for depth, col in zip(*(index.tolist() for index in np.nonzero(filled))):
+            self.row_hashes[depth] ^= ZOBRIST_COLUMNS[col]
+        self.hash = sum(value * ZOBRIST_POWERS[self.height - 1 - depth]
+                        for depth, value in enumerate(self.row_hashes)) & ZOBRIST_MASK
+        self.version += 1
+
+
+GRID_BACKENDS = {"array": Grid, "bitboard": BitboardGrid, "sparse": SparseGrid}
 
 
 class ScoreManager:
+    __slots__ = ("score", "level", "lines_cleared")
+
     def __init__(self):
         self.score = 0
         self.level = 1
@@ -90,6 +653,16 @@ class ScoreManager:
     def get_fall_delay(self):
         return max(50, 600 - (self.level - 1) * 50)
 
+    def get_fall_ticks(self, fps=FPS):
+        return max(1, -(-self.get_fall_delay() * fps // 1000))
+
+    def copy(self):
+        score_manager = ScoreManager.__new__(ScoreManager)
+        score_manager.score = self.score
+        score_manager.level = self.level
+        score_manager.lines_cleared = self.lines_cleared
+        return score_manager
+
     def reset(self):
         self.score = 0
         self.level = 1
@@ -109,21 +682,33 @@ class GameBase(ABC):
 
 
 class TetrisGame(GameBase):
-    def __init__(self):
+    def __init__(self, grid_cls=Grid, seed=None, randomizer="uniform", width=COLS, height=ROWS):
         super().__init__()
-        self.grid = Grid()
+        self.grid = grid_cls(width, height)
         self.score_manager = ScoreManager()
-        self.current_piece = Piece()
-        self.next_piece = Piece()
+        self.sequence = PieceSequence(seed, randomizer)
+        self.pieces = PiecePool(width)
+        self.current_piece = self.pieces.acquire(self.sequence.next())
+        self.next_piece = self.pieces.acquire(self.sequence.next())
         self.fall_timer = 0
         self.game_over = False
         self.game_state = "start"
+        self.dirty = True
+        self.recorder = None
+        self.player = None
+        self.stats = None
+        self.profiler = None
 
     def handle_input(self, event):
         if event.type == pygame.QUIT:
             return False
+        elif event.type in EXPOSE_EVENTS:
+            self.dirty = True
         elif event.type == pygame.KEYDOWN:
-            if self.game_state == "start":
+            self.dirty = True
+            if event.key == pygame.K_F3 and self.profiler is not None:
+                self.profiler.overlay = not self.profiler.overlay
+            elif self.game_state == "start":
                 if event.key == pygame.K_RETURN:
                     self.game_state = "playing"
                 elif event.key == pygame.K_ESCAPE:
@@ -131,75 +716,201 @@ class TetrisGame(GameBase):
             elif self.game_state == "playing":
                 if self.game_over:
                     if event.key == pygame.K_r:
-                        self.reset()
-                    elif event.key == pygame.K_ESCAPE:
-                        self.game_state = "start"
-                        self.reset()
-                else:
-                    new_x, new_y = self.current_piece.x, self.current_piece.y
-                    new_shape = self.current_piece.shape
-                    if event.key == pygame.K_LEFT:
-                        new_x -= 1
-                    elif event.key == pygame.K_RIGHT:
-                        new_x += 1
-                    elif event.key == pygame.K_DOWN:
-                        new_y += 1
-                    elif event.key == pygame.K_UP:
-                        new_shape = self.current_piece.rotate()
-                    elif event.key == pygame.K_SPACE:
-                        while self.grid.is_valid_position(self.current_piece, y=self.current_piece.y + 1):
-                            self.current_piece.y += 1
-                        self._place_piece()
-                        return True
+                        self.apply_action(ACTION_RESET)
                     elif event.key == pygame.K_ESCAPE:
                         self.game_state = "start"
-                        self.reset()
-                    if self.grid.is_valid_position(self.current_piece, new_shape, new_x, new_y):
-                        self.current_piece.x, self.current_piece.y = new_x, new_y
-                        self.current_piece.shape = new_shape
+                        self.apply_action(ACTION_RESET)
+                elif event.key == pygame.K_ESCAPE:
+                    self.game_state = "start"
+                    self.apply_action(ACTION_RESET)
+                elif self.player is not None and event.key == pygame.K_a:
+                    self.player.enabled = not self.player.enabled
+                elif event.key in KEY_ACTIONS and (self.player is None or not self.player.enabled):
+                    self.apply_action(KEY_ACTIONS[event.key])
         return True
 
+    def apply_action(self, action):
+        if self.recorder is not None:
+            self.recorder.record(action)
+        if action == ACTION_RESET:
+            self.reset()
+            return
+        piece = self.current_piece
+        if action == ACTION_DROP:
+            piece.y += self.grid.drop_distance(piece)
+            self._place_piece()
+            return
+        if action == ACTION_GRAVITY:
+            piece.y += 1
+            if not self.grid.is_valid_position(piece):
+                piece.y -= 1
+                self._place_piece()
+            return
+        new_x, new_y = piece.x, piece.y
+        new_rotation = piece.rotation
+        if action == ACTION_LEFT:
+            new_x -= 1
+        elif action == ACTION_RIGHT:
+            new_x += 1
+        elif action == ACTION_DOWN:
+            new_y += 1
+        elif action == ACTION_ROTATE:
+            new_rotation = piece.rotate()
+        if self.grid.is_valid_position(piece, new_rotation, new_x, new_y):
+            piece.x, piece.y = new_x, new_y
+            piece.rotation = new_rotation
+
     def update(self, dt):
+        if self.player is not None and self.game_state == "playing":
+            self.player.play(self)
+            self.dirty = self.dirty or self.player.enabled
         if self.game_state == "playing" and not self.game_over:
             self.fall_timer += dt
             if self.fall_timer >= self.score_manager.get_fall_delay():
-                self.current_piece.y += 1
-                if not self.grid.is_valid_position(self.current_piece):
-                    self.current_piece.y -= 1
-                    self._place_piece()
+                self.apply_action(ACTION_GRAVITY)
+                self.fall_timer = 0
+                self.dirty = True
+        if self.recorder is not None:
+            self.recorder.advance()
+
+    def tick(self):
+        if self.player is not None and self.game_state == "playing":
+            self.player.play(self)
+        if self.game_state == "playing" and not self.game_over:
+            self.fall_timer += 1
+            if self.fall_timer >= self.score_manager.get_fall_ticks():
+                self.apply_action(ACTION_GRAVITY)
                 self.fall_timer = 0
+        if self.recorder is not None:
+            self.recorder.advance()
 
     def _place_piece(self):
+        self.dirty = True
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter_ns()
         cleared = self.grid.place_piece(self.current_piece)
+        if profiler is not None:
+            profiler.add(PHASE_PLACE, time.perf_counter_ns() - start)
         self.score_manager.add_lines(cleared)
+        if self.stats is not None:
+            self.stats.record_placement(self.current_piece.shape_idx, cleared)
+        self.pieces.release(self.current_piece)
         self.current_piece = self.next_piece
-        self.next_piece = Piece()
+        self.next_piece = self.pieces.acquire(self.sequence.next())
         if not self.grid.is_valid_position(self.current_piece):
             self.game_over = True
+            if self.stats is not None:
+                self.stats.record_game(self.score_manager)
 
     def reset(self):
         self.grid.reset()
         self.score_manager.reset()
-        self.current_piece = Piece()
-        self.next_piece = Piece()
+        self.pieces.release(self.current_piece)
+        self.pieces.release(self.next_piece)
+        self.current_piece = self.pieces.acquire(self.sequence.next())
+        self.next_piece = self.pieces.acquire(self.sequence.next())
         self.fall_timer = 0
         self.game_over = False
 
-    def run(self):
+    def _animating(self):
+        return self.player is not None and self.player.enabled and self.game_state == "playing"
+
+    def _wait_events(self):
+        if self.game_state == "playing" and not self.game_over:
+            event = pygame.event.wait(max(1, self.score_manager.get_fall_delay() - self.fall_timer))
+        else:
+            event = pygame.event.wait()
+        if event.type == pygame.NOEVENT:
+            return []
+        return [event, *pygame.event.get()]
+
+    def upcoming(self, n=1):
+        return self.sequence.peek(n)
+
+    def snapshot(self):
+        piece = self.current_piece
+        score = self.score_manager
+        header = SNAPSHOT_HEADER.pack(piece.shape_idx, piece.rotation, piece.x, piece.y,
+                                      self.next_piece.shape_idx, self.sequence.position, score.score,
+                                      score.level, score.lines_cleared, self.fall_timer, self.game_over)
+        grid = self.grid
+        return header + grid.region(grid.top, grid.height).astype(np.uint8).tobytes()
+
+    def restore(self, snapshot):
+        (shape_idx, rotation, x, y, next_idx, position, score, level, lines, fall_timer,
+         game_over) = SNAPSHOT_HEADER.unpack_from(snapshot)
+        grid = self.grid
+        grid.load(np.frombuffer(snapshot, dtype=np.uint8, offset=SNAPSHOT_HEADER.size).reshape(-1, grid.width))
+        piece = self.current_piece
+        piece.shape_idx, piece.rotation, piece.x, piece.y = shape_idx, rotation, x, y
+        self.next_piece.spawn(next_idx, grid.width)
+        self.sequence.seek(position)
+        self.score_manager.score = score
+        self.score_manager.level = level
+        self.score_manager.lines_cleared = lines
+        self.fall_timer = fall_timer
+        self.game_over = game_over
+
+    def clone(self):
+        game = TetrisGame.__new__(TetrisGame)
+        game.__dict__.update(self.__dict__)
+        game.grid = self.grid.clone()
+        game.score_manager = self.score_manager.copy()
+        game.sequence = self.sequence.clone()
+        game.pieces = PiecePool(self.pieces.board_width)
+        game.current_piece = self.current_piece.copy()
+        game.next_piece = self.next_piece.copy()
+        game.recorder = None
+        game.player = None
+        game.stats = None
+        game.profiler = None
+        return game
+
+    def run(self, compositing=False, player=None, profile=None, idle=True):
+        if player is not None:
+            self.player = player
+            self.game_state = "playing"
+        profiler = None
+        if profile is not None:
+            profiler = self.profiler = FrameProfiler(FPS)
         try:
             pygame.init()
-            screen = pygame.display.set_mode((TOTAL_WIDTH, HEIGHT))
+            renderer = TetrisRenderer(self.colors, compositing, self.grid.width, self.grid.height)
+            screen = pygame.display.set_mode(renderer.size)
             pygame.display.set_caption("Tetris")
             clock = pygame.time.Clock()
-            renderer = TetrisRenderer(self.colors)
+            renderer.profiler = profiler
             running = True
 
             while running:
+                if profiler is None:
+                    if idle and not self._animating():
+                        events = self._wait_events()
+                        dt = clock.tick()
+                    else:
+                        dt = clock.tick(FPS)
+                        events = pygame.event.get()
+                    for event in events:
+                        if event.type in EXPOSE_EVENTS:
+                            renderer.invalidate()
+                        running = self.handle_input(event)
+                    self.update(dt)
+                    if self.dirty or not idle:
+                        renderer.render(screen, self)
+                        self.dirty = False
+                    continue
                 dt = clock.tick(FPS)
+                start = profiler.begin_frame()
                 for event in pygame.event.get():
                     running = self.handle_input(event)
+                start = profiler.lap(PHASE_EVENTS, start)
                 self.update(dt)
+                start = profiler.lap(PHASE_UPDATE, start)
                 renderer.render(screen, self)
+                profiler.lap(PHASE_RENDER, start)
+            if profiler is not None:
+                profiler.dump(profile)
             pygame.quit()
 
         except Exception as e:
@@ -210,59 +921,137 @@ class TetrisGame(GameBase):
 
 
 class TetrisRenderer:
-    def __init__(self, colors):
+    def __init__(self, colors, compositing=False, width=COLS, height=ROWS):
         self.colors = colors
+        self.compositing = compositing
+        self.cols = width
+        self.cell = max(MIN_CELL, min(CELL, MAX_BOARD_WIDTH // width))
+        self.view_rows = min(height, HEIGHT // self.cell)
+        self.board_width = width * self.cell
+        self.board_height = self.view_rows * self.cell
+        self.total_width = self.board_width + PREVIEW_WIDTH
+        self.size = (self.total_width, HEIGHT)
+        self.board_rect = pygame.Rect(0, 0, self.board_width, self.board_height)
+        self.score_rect = pygame.Rect(self.board_width + 10, 10, PREVIEW_WIDTH - 10, 70)
+        self.preview_rect = pygame.Rect(self.board_width + 17, 104, 106, 106)
+        self._fonts = {}
+        self._text_cache = OrderedDict()
+        self._background = None
+        self._grid_overlay = None
+        self._board_layer = None
+        self._board_key = None
+        self._sidebar_key = None
+        self._piece_rects = []
+        self._needs_full = True
+        self.profiler = None
+        self._profile_lines = []
+        self._profile_frame = None
+        self._overlay_shown = False
+        self._build_sprites()
+
+    def _build_sprites(self):
+        self._block_sprites = []
+        self._preview_sprites = []
+        self._ghost_sprites = []
+        cell = self.cell
+        for color in self.colors:
+            block = pygame.Surface((cell, cell), pygame.SRCALPHA)
+            self._draw_block(block, color, block.get_rect())
+            preview = pygame.Surface((20, 20), pygame.SRCALPHA)
+            self._draw_block(preview, color, preview.get_rect())
+            ghost = pygame.Surface((cell, cell), pygame.SRCALPHA)
+            ghost.fill((*color[:3], 40))
+            self._block_sprites.append(block)
+            self._preview_sprites.append(preview)
+            self._ghost_sprites.append(ghost)
+
+    def invalidate(self):
+        self._needs_full = True
+
+    def _font(self, size, bold=False):
+        font = self._fonts.get((size, bold))
+        if font is None:
+            font = pygame.font.SysFont('consolas', size, bold=bold)
+            self._fonts[(size, bold)] = font
+        return font
+
+    def _text(self, font, text, color):
+        key = (font, text, color)
+        surface = self._text_cache.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self._text_cache[key] = surface
+            if len(self._text_cache) > TEXT_CACHE_SIZE:
+                self._text_cache.popitem(last=False)
+        else:
+            self._text_cache.move_to_end(key)
+        return surface
 
     def _draw_grid(self, surface):
-        for y in range(ROWS):
-            for x in range(COLS):
-                pygame.draw.rect(surface, (60, 60, 60), (x * CELL, y * CELL, CELL, CELL), 1)
+        cell = self.cell
+        for y in range(self.view_rows):
+            for x in range(self.cols):
+                pygame.draw.rect(surface, (60, 60, 60), (x * cell, y * cell, cell, cell), 1)
 
     def _draw_block(self, surface, color, rect):
         pygame.draw.rect(surface, color, rect, border_radius=6)
         pygame.draw.rect(surface, (255, 255, 255), rect, 2, border_radius=6)
 
-    def _draw_ghost(self, screen, grid, piece):
-        ghost_y = piece.y
-        while grid.is_valid_position(piece, y=ghost_y + 1):
-            ghost_y += 1
-        for bx, by, color in piece.get_blocks(y=ghost_y):
-            rect = pygame.Rect(bx * CELL, by * CELL, CELL, CELL)
-            s = pygame.Surface((CELL, CELL), pygame.SRCALPHA)
-            s.fill((*self.colors[color][:3], 40))
-            screen.blit(s, rect.topleft)
+    def _viewport(self, game):
+        rows = game.grid.height
+        if rows <= self.view_rows:
+            return 0
+        top = game.current_piece.y - self.view_rows // 3
+        return min(max(top, 0), rows - self.view_rows)
+
+    def _draw_ghost(self, screen, grid, piece, top=0):
+        ghost_y = piece.y + grid.drop_distance(piece)
+        sprite = self._ghost_sprites[piece.color]
+        cell = self.cell
+        screen.blits([(sprite, (bx * cell, (by - top) * cell)) for bx, by, _ in piece.get_blocks(y=ghost_y)],
+                     doreturn=False)
+        return ghost_y
+
+    def _draw_piece(self, screen, piece, top=0):
+        sprite = self._block_sprites[piece.color]
+        cell = self.cell
+        screen.blits([(sprite, (bx * cell, (by - top) * cell)) for bx, by, _ in piece.get_blocks()],
+                     doreturn=False)
 
     def _draw_next_piece(self, screen, piece):
-        preview_x = WIDTH + 20
+        self._draw_preview_frame(screen)
+        self._draw_preview_blocks(screen, piece)
+
+    def _draw_preview_frame(self, screen):
+        preview_x = self.board_width + 20
         preview_y = 107
-        font = pygame.font.SysFont('consolas', 20)
-        text = font.render('NEXT:', True, (255, 255, 255))
+        font = self._font(20)
+        text = self._text(font, 'NEXT:', (255, 255, 255))
         screen.blit(text, (preview_x, preview_y - 23))
         pygame.draw.rect(screen, (40, 40, 40), (preview_x - 5, preview_y - 5, 110, 110))
         pygame.draw.rect(screen, (100, 100, 100), (preview_x - 5, preview_y - 5, 110, 110), 2)
-        offset_x = (4 - piece.shape.shape[1]) * CELL // 4
-        offset_y = (4 - piece.shape.shape[0]) * CELL // 4
-        for y in range(piece.shape.shape[0]):
-            for x in range(piece.shape.shape[1]):
-                if piece.shape[y, x]:
-                    small_rect = pygame.Rect(
-                        preview_x + x * 20 + offset_x,
-                        preview_y + y * 20 + offset_y,
-                        20, 20
-                    )
-                    self._draw_block(screen, self.colors[piece.color], small_rect)
+
+    def _draw_preview_blocks(self, screen, piece):
+        preview_x = self.board_width + 20
+        preview_y = 107
+        state = piece.state
+        offset_x = (4 - state.width) * CELL // 4
+        offset_y = (4 - state.height) * CELL // 4
+        sprite = self._preview_sprites[piece.color]
+        screen.blits([(sprite, (preview_x + x * 20 + offset_x, preview_y + y * 20 + offset_y))
+                      for x, y in state.cells], doreturn=False)
 
     def _draw_start_screen(self, screen):
         screen.fill((20, 20, 40))
-        font_huge = pygame.font.SysFont('consolas', 72, bold=True)
-        font_medium = pygame.font.SysFont('consolas', 24)
-        font_small = pygame.font.SysFont('consolas', 18)
-        font_tiny = pygame.font.SysFont('consolas', 16)
-        title_text = font_huge.render('TETRIS', True, (0, 255, 255))
-        title_rect = title_text.get_rect(center=(TOTAL_WIDTH // 2, HEIGHT // 4))
+        font_huge = self._font(72, bold=True)
+        font_medium = self._font(24)
+        font_small = self._font(18)
+        font_tiny = self._font(16)
+        title_text = self._text(font_huge, 'TETRIS', (0, 255, 255))
+        title_rect = title_text.get_rect(center=(self.total_width // 2, HEIGHT // 4))
         screen.blit(title_text, title_rect)
-        start_text = font_medium.render('Press ENTER to start', True, (255, 255, 255))
-        start_rect = start_text.get_rect(center=(TOTAL_WIDTH // 2, HEIGHT // 2))
+        start_text = self._text(font_medium, 'Press ENTER to start', (255, 255, 255))
+        start_rect = start_text.get_rect(center=(self.total_width // 2, HEIGHT // 2))
         screen.blit(start_text, start_rect)
         controls = [
             "CONTROLS:",
@@ -274,82 +1063,203 @@ class TetrisRenderer:
         for i, line in enumerate(controls):
             color = (255, 255, 0) if i == 0 else (200, 200, 200)
             font = font_small if i == 0 else font_tiny
-            text = font.render(line, True, color)
-            text_rect = text.get_rect(center=(TOTAL_WIDTH // 2, HEIGHT // 2 + 80 + i * 25))
+            text = self._text(font, line, color)
+            text_rect = text.get_rect(center=(self.total_width // 2, HEIGHT // 2 + 80 + i * 25))
             screen.blit(text, text_rect)
-        exit_text = font_tiny.render('ESC - Exit', True, (150, 150, 150))
-        exit_rect = exit_text.get_rect(center=(TOTAL_WIDTH // 2, HEIGHT - 50))
+        exit_text = self._text(font_tiny, 'ESC - Exit', (150, 150, 150))
+        exit_rect = exit_text.get_rect(center=(self.total_width // 2, HEIGHT - 50))
         screen.blit(exit_text, exit_rect)
 
     def _draw_game_over(self, screen, score, level):
-        overlay = pygame.Surface((TOTAL_WIDTH, HEIGHT))
+        overlay = pygame.Surface((self.total_width, HEIGHT))
         overlay.set_alpha(180)
         overlay.fill((0, 0, 0))
         screen.blit(overlay, (0, 0))
         box_width = 400
         box_height = 250
-        box_x = (TOTAL_WIDTH - box_width) // 2
+        box_x = (self.total_width - box_width) // 2
         box_y = (HEIGHT - box_height) // 2
         pygame.draw.rect(screen, (40, 40, 40), (box_x, box_y, box_width, box_height), border_radius=15)
         pygame.draw.rect(screen, (255, 255, 255), (box_x, box_y, box_width, box_height), 3, border_radius=15)
-        font_large = pygame.font.SysFont('consolas', 48, bold=True)
-        font_medium = pygame.font.SysFont('consolas', 32)
-        font_small = pygame.font.SysFont('consolas', 20)
-        game_over_text = font_large.render('GAME OVER', True, (255, 50, 50))
-        game_over_rect = game_over_text.get_rect(center=(TOTAL_WIDTH // 2, box_y + 50))
+        font_large = self._font(48, bold=True)
+        font_medium = self._font(32)
+        font_small = self._font(20)
+        game_over_text = self._text(font_large, 'GAME OVER', (255, 50, 50))
+        game_over_rect = game_over_text.get_rect(center=(self.total_width // 2, box_y + 50))
         screen.blit(game_over_text, game_over_rect)
-        score_text = font_medium.render(f'Final score: {score}', True, (255, 255, 255))
-        score_rect = score_text.get_rect(center=(TOTAL_WIDTH // 2, box_y + 110))
+        score_text = self._text(font_medium, f'Final score: {score}', (255, 255, 255))
+        score_rect = score_text.get_rect(center=(self.total_width // 2, box_y + 110))
         screen.blit(score_text, score_rect)
-        level_text = font_medium.render(f'Level reached: {level}', True, (255, 255, 255))
-        level_rect = level_text.get_rect(center=(TOTAL_WIDTH // 2, box_y + 150))
+        level_text = self._text(font_medium, f'Level reached: {level}', (255, 255, 255))
+        level_rect = level_text.get_rect(center=(self.total_width // 2, box_y + 150))
         screen.blit(level_text, level_rect)
-        restart_text = font_small.render('Press R to restart', True, (200, 200, 200))
-        restart_rect = restart_text.get_rect(center=(TOTAL_WIDTH // 2, box_y + 190))
+        restart_text = self._text(font_small, 'Press R to restart', (200, 200, 200))
+        restart_rect = restart_text.get_rect(center=(self.total_width // 2, box_y + 190))
         screen.blit(restart_text, restart_rect)
-        quit_text = font_small.render('or ESC to exit', True, (200, 200, 200))
-        quit_rect = quit_text.get_rect(center=(TOTAL_WIDTH // 2, box_y + 210))
+        quit_text = self._text(font_small, 'or ESC to exit', (200, 200, 200))
+        quit_rect = quit_text.get_rect(center=(self.total_width // 2, box_y + 210))
         screen.blit(quit_text, quit_rect)
 
+    def _draw_locked(self, surface, cells):
+        sprites = self._block_sprites
+        cell = self.cell
+        ys, xs = np.nonzero(cells)
+        surface.blits([(sprites[color], (x * cell, y * cell))
+                       for y, x, color in zip(ys.tolist(), xs.tolist(), cells[ys, xs].tolist())],
+                      doreturn=False)
+
+    def _draw_score(self, screen, score_manager):
+        font = self._font(24)
+        score_text = self._text(font, f'Score: {score_manager.score}', (255, 255, 255))
+        level_text = self._text(font, f'Level: {score_manager.level}', (255, 255, 255))
+        screen.blit(score_text, (self.board_width + 20, 20))
+        screen.blit(level_text, (self.board_width + 20, 50))
+
+    def _draw_controls(self, screen):
+        font_small = self._font(16)
+        controls = [
+            "Controls:",
+            "← → Move",
+            "↓ Soft drop",
+            "↑ Rotate",
+            "Space Hard drop"
+        ]
+        for i, line in enumerate(controls):
+            text = self._text(font_small, line, (200, 200, 200))
+            screen.blit(text, (self.board_width + 20, 250 + i * 20))
+
+    def _draw_board_lines(self, surface):
+        self._draw_grid(surface)
+        pygame.draw.rect(surface, (200, 200, 200), self.board_rect, 3)
+
+    def _build_static_layers(self):
+        self._background = pygame.Surface((self.total_width, HEIGHT))
+        self._background.fill(self.colors[0])
+        self._draw_board_lines(self._background)
+        self._draw_preview_frame(self._background)
+        self._draw_controls(self._background)
+        self._grid_overlay = pygame.Surface(self.board_rect.size, pygame.SRCALPHA)
+        self._draw_board_lines(self._grid_overlay)
+        self._board_layer = pygame.Surface(self.board_rect.size)
+
+    def _piece_rect(self, piece, y):
+        state = piece.state
+        cell = self.cell
+        return pygame.Rect(piece.x * cell, y * cell, state.width * cell, state.height * cell)
+
+    def _render_composited(self, screen, game):
+        if self._background is None:
+            self._build_static_layers()
+        rects = []
+        if self._needs_full:
+            screen.blit(self._background, (0, 0))
+            rects.append(screen.get_rect())
+            self._board_key = None
+            self._sidebar_key = None
+            self._needs_full = False
+
+        top = self._viewport(game)
+        board_key = (id(game.grid), game.grid.version, top)
+        if board_key != self._board_key:
+            self._board_layer.blit(self._background, (0, 0), self.board_rect)
+            self._draw_locked(self._board_layer, game.grid.region(top, top + self.view_rows))
+            self._board_layer.blit(self._grid_overlay, (0, 0))
+            self._board_key = board_key
+            screen.blit(self._board_layer, (0, 0))
+            rects.append(self.board_rect)
+        else:
+            for rect in self._piece_rects:
+                screen.blit(self._board_layer, rect, rect)
+            rects.extend(self._piece_rects)
+
+        piece = game.current_piece
+        ghost_y = self._draw_ghost(screen, game.grid, piece, top)
+        self._draw_piece(screen, piece, top)
+        self._piece_rects = [self._piece_rect(piece, ghost_y - top).clip(self.board_rect),
+                             self._piece_rect(piece, piece.y - top).clip(self.board_rect)]
+        for rect in self._piece_rects:
+            screen.blit(self._grid_overlay, rect, rect)
+        rects.extend(self._piece_rects)
+
+        sidebar_key = (game.score_manager.score, game.score_manager.level, game.next_piece.shape_idx)
+        if sidebar_key != self._sidebar_key:
+            screen.blit(self._background, self.score_rect, self.score_rect)
+            screen.blit(self._background, self.preview_rect, self.preview_rect)
+            self._draw_score(screen, game.score_manager)
+            self._draw_preview_blocks(screen, game.next_piece)
+            self._sidebar_key = sidebar_key
+            rects.extend((self.score_rect, self.preview_rect))
+        self._present(screen, rects)
+
+    def _draw_profile(self, screen, profiler):
+        if self._profile_frame is None or profiler.frames - self._profile_frame >= PROFILE_REFRESH:
+            summary = profiler.summary()
+            self._profile_lines = [f"dropped {summary['dropped']}/{summary['frames']}"]
+            self._profile_lines += [f"{phase:<6} {q['p50']:6.2f} {q['p95']:6.2f} {q['p99']:6.2f}"
+                                    for phase, q in summary["phases_ms"].items()]
+            self._profile_frame = profiler.frames
+        font = self._font(14)
+        rect = pygame.Rect(4, 4, 200, 6 + 16 * len(self._profile_lines))
+        screen.fill((0, 0, 0), rect)
+        for i, line in enumerate(self._profile_lines):
+            screen.blit(self._text(font, line, (0, 255, 0)), (rect.x + 4, rect.y + 3 + i * 16))
+        return rect
+
+    def _present(self, screen, rects=None):
+        profiler = self.profiler
+        if profiler is None:
+            if rects is None:
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+            return
+        if profiler.overlay:
+            rect = self._draw_profile(screen, profiler)
+            if rects is not None:
+                rects.append(rect)
+        elif self._overlay_shown:
+            self._needs_full = True
+        self._overlay_shown = profiler.overlay
+        start = time.perf_counter_ns()
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        profiler.add(PHASE_FLIP, time.perf_counter_ns() - start)
+
     def render(self, screen, game):
+        if self.compositing and game.game_state == "playing" and not game.game_over:
+            self._render_composited(screen, game)
+            return
+        self._needs_full = True
         screen.fill(self.colors[0])
         if game.game_state == "start":
             self._draw_start_screen(screen)
         elif game.game_state == "playing":
+            top = self._viewport(game)
             if not game.game_over:
-                self._draw_ghost(screen, game.grid, game.current_piece)
-                for bx, by, color in game.current_piece.get_blocks():
-                    self._draw_block(screen, self.colors[color],
-                                     pygame.Rect(bx * CELL, by * CELL, CELL, CELL))
-            for y in range(ROWS):
-                for x in range(COLS):
-                    if game.grid.cells[y, x]:
-                        self._draw_block(screen, self.colors[game.grid.cells[y, x]],
-                                         pygame.Rect(x * CELL, y * CELL, CELL, CELL))
-            self._draw_grid(screen)
-            pygame.draw.rect(screen, (200, 200, 200), (0, 0, WIDTH, HEIGHT), 3)
+                self._draw_ghost(screen, game.grid, game.current_piece, top)
+                self._draw_piece(screen, game.current_piece, top)
+            self._draw_locked(screen, game.grid.region(top, top + self.view_rows))
+            self._draw_board_lines(screen)
             self._draw_next_piece(screen, game.next_piece)
-            font = pygame.font.SysFont('consolas', 24)
-            score_text = font.render(f'Score: {game.score_manager.score}', True, (255, 255, 255))
-            level_text = font.render(f'Level: {game.score_manager.level}', True, (255, 255, 255))
-            screen.blit(score_text, (WIDTH + 20, 20))
-            screen.blit(level_text, (WIDTH + 20, 50))
-            font_small = pygame.font.SysFont('consolas', 16)
-            controls = [
-                "Controls:",
-                "← → Move",
-                "↓ Soft drop",
-                "↑ Rotate",
-                "Space Hard drop"
-            ]
-            for i, line in enumerate(controls):
-                text = font_small.render(line, True, (200, 200, 200))
-                screen.blit(text, (WIDTH + 20, 250 + i * 20))
+            self._draw_score(screen, game.score_manager)
+            self._draw_controls(screen)
             if game.game_over:
                 self._draw_game_over(screen, game.score_manager.score, game.score_manager.level)
-        pygame.display.flip()
+        self._present(screen)
 
 
 if __name__ == "__main__":
-    game = TetrisGame()
-    game.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Play Tetris.")
+    parser.add_argument("--compositing", action="store_true")
+    parser.add_argument("--profile", default=None, help="profile frames and dump to this .json or .csv file")
+    parser.add_argument("--fixed-rate", action="store_true", help=f"render every frame at {FPS} fps, even when idle")
+    parser.add_argument("--cols", type=int, default=COLS)
+    parser.add_argument("--rows", type=int, default=ROWS)
+    parser.add_argument("--grid", choices=GRID_BACKENDS, default=None,
+                        help="grid backend (default: array, or sparse for boards taller than the window)")
+    args = parser.parse_args()
+    grid = args.grid or ("sparse" if args.rows > ROWS else "array")
+    game = TetrisGame(GRID_BACKENDS[grid], width=args.cols, height=args.rows)
+    game.run(args.compositing, profile=args.profile, idle=not args.fixed_rate)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import argparse
+import random
+import time
+
+from final_game import TetrisGame, ACTION_NONE, ACTION_GRAVITY
+
+
+class ScriptedInput:
+    def __init__(self, script):
+        self.actions = {}
+        for tick, action in script:
+            self.actions.setdefault(tick, []).append(action)
+
+    def __call__(self, game, tick):
+        return self.actions.get(tick, ())
+
+
+class RandomInput:
+    def __init__(self, seed=None, rate=0.25):
+        self.rng = random.Random(seed)
+        self.rate = rate
+
+    def __call__(self, game, tick):
+        if self.rng.random() < self.rate:
+            return (self.rng.randint(ACTION_NONE + 1, ACTION_GRAVITY - 1),)
+        return ()
+
+
+class HeadlessRunner:
+    def __init__(self, game, controller=None):
+        self.game = game
+        self.controller = controller
+        self.ticks = 0
+        self.elapsed = 0.0
+        game.game_state = "playing"
+
+    def step(self):
+        game = self.game
+        if self.controller is not None:
+            for action in self.controller(game, self.ticks):
+                if game.game_over:
+                    break
+                game.apply_action(action)
+        game.tick()
+        self.ticks += 1
+
+    def run(self, max_ticks=None):
+        start = time.perf_counter()
+        while not self.game.game_over and (max_ticks is None or self.ticks < max_ticks):
+            self.step()
+        self.elapsed += time.perf_counter() - start
+        return self.ticks
+
+    @property
+    def ticks_per_second(self):
+        return self.ticks / self.elapsed if self.elapsed else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Tetris games without a display.")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-ticks", type=int, default=None)
+    args = parser.parse_args()
+
+    total_ticks = 0
+    total_time = 0.0
+    for seed in range(args.seed, args.seed + args.games):
+        runner = HeadlessRunner(TetrisGame(seed=seed), RandomInput(seed))
+        runner.run(args.max_ticks)
+        total_ticks += runner.ticks
+        total_time += runner.elapsed
+        score = runner.game.score_manager
+        print(f"seed {seed}: {runner.ticks} ticks, score {score.score}, "
+              f"lines {score.lines_cleared}, {runner.ticks_per_second:,.0f} ticks/s")
+    print(f"total: {total_ticks} ticks in {total_time:.3f}s, {total_ticks / total_time:,.0f} ticks/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pygame
+
+from batch_sim import BatchSimulator
+from final_game import CELL, COLS, ROWS, Piece, TetrisGame
+
+GRID_COLOR = (60, 60, 60)
+OUTLINE_COLOR = (255, 255, 255)
+
+
+class BoardRenderer:
+    def __init__(self, colors, scale=4):
+        self.colors = colors
+        self.scale = scale
+        self.tiles = self._build_tiles()
+
+    def _build_tiles(self):
+        scale = self.scale
+        tiles = np.empty((len(self.colors), scale, scale, 3), dtype=np.uint8)
+        tiles[:] = np.asarray(self.colors, dtype=np.uint8)[:, None, None, :3]
+        edge = np.zeros((scale, scale), dtype=bool)
+        width = max(1, round(2 * scale / CELL))
+        edge[:width] = edge[-width:] = edge[:, :width] = edge[:, -width:] = True
+        if scale >= 4:
+            tiles[0][edge] = GRID_COLOR
+        if scale >= 3:
+            tiles[1:, edge] = OUTLINE_COLOR
+        return tiles
+
+    @staticmethod
+    def game_boards(games, pieces=True):
+        height, width = (games[0].grid.height, games[0].grid.width) if games else (ROWS, COLS)
+        boards = np.empty((len(games), height, width), dtype=np.uint8)
+        for board, game in zip(boards, games):
+            board[:] = game.grid.cells
+            if pieces and not game.game_over:
+                for x, y, color in game.current_piece.get_blocks():
+                    board[y, x] = color
+        return boards
+
+    @staticmethod
+    def sim_boards(sim, pieces=True):
+        boards = sim.boards.copy()
+        if pieces:
+            offsets = Piece.OFFSETS[sim.shape, sim.rotation]
+            xs = sim.x[:, None] + offsets[..., 0]
+            ys = sim.y[:, None] + offsets[..., 1]
+            boards[np.arange(sim.n)[:, None], ys, xs] = (sim.shape + 1)[:, None]
+        return boards
+
+    def render(self, boards):
+        boards = np.asarray(boards)
+        count, rows, cols = boards.shape
+        scale = self.scale
+        images = self.tiles[boards].transpose(0, 1, 3, 2, 4, 5)
+        return images.reshape(count, rows * scale, cols * scale, 3)
+
+    def atlas(self, boards, columns=8, gap=2):
+        images = self.render(boards)
+        count, height, width, _ = images.shape
+        rows = -(-count // columns)
+        atlas = np.zeros((rows, height + gap, columns, width + gap, 3), dtype=np.uint8)
+        padded = np.zeros((rows * columns, height, width, 3), dtype=np.uint8)
+        padded[:count] = images
+        atlas[:, :height, :, :width] = padded.reshape(rows, columns, height, width, 3).transpose(0, 2, 1, 3, 4)
+        return atlas.reshape(rows * (height + gap), columns * (width + gap), 3)
+
+    def atlas_surface(self, boards, columns=8, gap=2):
+        return pygame.surfarray.make_surface(self.atlas(boards, columns, gap).transpose(1, 0, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render many Tetris boards offscreen.")
+    parser.add_argument("--boards", type=int, default=64)
+    parser.add_argument("--scale", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--output", default=None, help="save the final atlas as an image")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    renderer = BoardRenderer(TetrisGame().colors, args.scale)
+    sim = BatchSimulator(args.boards)
+    rng = np.random.default_rng(0)
+    rendered = 0
+    elapsed = 0.0
+    for _ in range(args.steps):
+        sim.step(rng.integers(0, 7, args.boards))
+        start = time.perf_counter()
+        frames = renderer.render(renderer.sim_boards(sim))
+        elapsed += time.perf_counter() - start
+        rendered += len(frames)
+    print(f"{rendered / elapsed:,.0f} boards/s at scale {args.scale} "
+          f"({frames.shape[1]}x{frames.shape[2]} px per board)")
+    if args.output is not None:
+        pygame.image.save(renderer.atlas_surface(renderer.sim_boards(sim), args.columns), args.output)
+
+
+if __name__ == "__main__":
+    main()
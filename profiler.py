@@ -0,0 +1,78 @@
+import csv
+import json
+import time
+
+import numpy as np
+
+PHASES = ("events", "update", "place", "render", "flip", "frame")
+(PHASE_EVENTS, PHASE_UPDATE, PHASE_PLACE, PHASE_RENDER, PHASE_FLIP, PHASE_FRAME) = range(len(PHASES))
+PROFILE_FRAMES = 1024
+PERCENTILES = (50, 95, 99)
+DROP_FACTOR = 1.5
+
+
+class FrameProfiler:
+    def __init__(self, fps, size=PROFILE_FRAMES):
+        self.size = size
+        self.samples = np.zeros((size, len(PHASES)), dtype=np.int64)
+        self.frames = 0
+        self.dropped = 0
+        self.frame_budget = 1_000_000_000 // fps
+        self.overlay = False
+        self._current = [0] * len(PHASES)
+        self._nested = 0
+        self._frame_start = None
+
+    def begin_frame(self):
+        now = time.perf_counter_ns()
+        if self._frame_start is not None:
+            self._current[PHASE_FRAME] = now - self._frame_start
+            self.end_frame()
+        self._frame_start = now
+        return now
+
+    def lap(self, phase, start):
+        now = time.perf_counter_ns()
+        self._current[phase] += now - start - self._nested
+        self._nested = 0
+        return now
+
+    def add(self, phase, elapsed):
+        self._current[phase] += elapsed
+        self._nested += elapsed
+
+    def end_frame(self):
+        current = self._current
+        self.samples[self.frames % self.size] = current
+        self.frames += 1
+        if current[PHASE_FRAME] > self.frame_budget * DROP_FACTOR:
+            self.dropped += 1
+        self._current = [0] * len(PHASES)
+
+    def recent(self):
+        if self.frames < self.size:
+            return self.samples[:self.frames]
+        split = self.frames % self.size
+        return np.concatenate((self.samples[split:], self.samples[:split]))
+
+    def summary(self):
+        samples = self.recent()
+        phases = {}
+        for index, phase in enumerate(PHASES):
+            values = samples[:, index] / 1e6
+            if len(values):
+                quantiles = np.percentile(values, PERCENTILES)
+                phases[phase] = {f"p{p}": round(float(q), 3) for p, q in zip(PERCENTILES, quantiles)}
+                phases[phase]["max"] = round(float(values.max()), 3)
+        return {"frames": self.frames, "dropped": self.dropped, "window": len(samples),
+                "budget_ms": self.frame_budget / 1e6, "phases_ms": phases}
+
+    def dump(self, path):
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow([f"{phase}_us" for phase in PHASES])
+                writer.writerows((self.recent() // 1000).tolist())
+        else:
+            with open(path, "w") as f:
+                json.dump(self.summary(), f, indent=2)
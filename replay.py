@@ -0,0 +1,205 @@
+import argparse
+import bisect
+import time
+
+import pygame
+
+from final_game import FPS, Grid, PieceSequence, TetrisGame, TetrisRenderer
+from headless import HeadlessRunner, RandomInput
+
+MAGIC = b"TRPL"
+VERSION = 2
+KEYFRAME = 15
+KEYFRAME_INTERVAL = FPS * 60
+
+
+def write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class ReplayRecorder:
+    def __init__(self, stream, game, keyframe_interval=KEYFRAME_INTERVAL):
+        self.stream = stream
+        self.game = game
+        self.keyframe_interval = keyframe_interval
+        self.tick = 0
+        self._last_tick = 0
+        self._buffer = bytearray(MAGIC)
+        self._buffer.append(VERSION)
+        write_varint(self._buffer, game.sequence.seed)
+        self._buffer.append(PieceSequence.MODES.index(game.sequence.mode))
+        for value in (game.grid.width, game.grid.height, FPS, keyframe_interval):
+            write_varint(self._buffer, value)
+        self._write_keyframe()
+        game.recorder = self
+
+    def _write_event(self, code):
+        write_varint(self._buffer, (self.tick - self._last_tick) << 4 | code)
+        self._last_tick = self.tick
+
+    def _write_keyframe(self):
+        state = self.game.snapshot()
+        self._write_event(KEYFRAME)
+        write_varint(self._buffer, len(state))
+        self._buffer += state
+
+    def record(self, action):
+        self._write_event(action)
+
+    def advance(self):
+        self.tick += 1
+        if self.tick % self.keyframe_interval == 0:
+            self._write_keyframe()
+        if len(self._buffer) >= 1 << 16:
+            self.flush()
+
+    def flush(self):
+        self.stream.write(self._buffer)
+        self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.game.recorder = None
+
+
+class ReplayPlayer:
+    def __init__(self, data, grid_cls=Grid):
+        if data[:4] != MAGIC:
+            raise ValueError("Not a Tetris replay")
+        if data[4] != VERSION:
+            raise ValueError(f"Unsupported replay version: {data[4]}")
+        seed, pos = read_varint(data, 5)
+        self.randomizer = PieceSequence.MODES[data[pos]]
+        cols, pos = read_varint(data, pos + 1)
+        rows, pos = read_varint(data, pos)
+        self.fps, pos = read_varint(data, pos)
+        self.keyframe_interval, pos = read_varint(data, pos)
+        self.seed = seed
+
+        ticks, actions, keyframes = [], [], []
+        tick = 0
+        while pos < len(data):
+            value, pos = read_varint(data, pos)
+            tick += value >> 4
+            code = value & 0xF
+            if code == KEYFRAME:
+                size, pos = read_varint(data, pos)
+                keyframes.append((tick, len(ticks), bytes(data[pos:pos + size])))
+                pos += size
+            else:
+                ticks.append(tick)
+                actions.append(code)
+        self.ticks = ticks
+        self.actions = actions
+        self.keyframes = keyframes
+        self.length = max(ticks[-1] + 1 if ticks else 0, keyframes[-1][0] if keyframes else 0)
+        self.game = TetrisGame(grid_cls, seed, self.randomizer, cols, rows)
+        self.game.game_state = "playing"
+        self.tick = 0
+        self._event = 0
+        self._restore(keyframes[0])
+
+    @classmethod
+    def load(cls, path, grid_cls=Grid):
+        with open(path, "rb") as f:
+            return cls(f.read(), grid_cls)
+
+    def _restore(self, keyframe):
+        self.tick, self._event, state = keyframe
+        self.game.restore(state)
+        # Gravity is replayed from the recorded events, so the frame timer is not part of the replayed state.
+        self.game.fall_timer = 0
+
+    def advance_to(self, tick):
+        ticks, actions = self.ticks, self.actions
+        apply_action = self.game.apply_action
+        event = self._event
+        while event < len(ticks) and ticks[event] < tick:
+            apply_action(actions[event])
+            event += 1
+        self._event = event
+        self.tick = tick
+
+    def seek(self, tick):
+        index = bisect.bisect_right([keyframe[0] for keyframe in self.keyframes], tick) - 1
+        keyframe = self.keyframes[max(index, 0)]
+        if tick < self.tick or keyframe[0] > self.tick:
+            self._restore(keyframe)
+        self.advance_to(tick)
+
+    def play(self):
+        start = time.perf_counter()
+        self.advance_to(self.length)
+        return self.length / max(time.perf_counter() - start, 1e-9)
+
+    def watch(self, speed=1.0):
+        pygame.init()
+        renderer = TetrisRenderer(self.game.colors, width=self.game.grid.width, height=self.game.grid.height)
+        screen = pygame.display.set_mode(renderer.size)
+        pygame.display.set_caption("Tetris replay")
+        clock = pygame.time.Clock()
+        running = True
+        while running and self.tick < self.length:
+            clock.tick(self.fps * speed)
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+            self.advance_to(self.tick + 1)
+            renderer.render(screen, self.game)
+        pygame.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or play back Tetris replays.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record")
+    record.add_argument("path")
+    record.add_argument("--seed", type=int, default=0)
+    record.add_argument("--randomizer", choices=PieceSequence.MODES, default="uniform")
+    record.add_argument("--max-ticks", type=int, default=None)
+    play = commands.add_parser("play")
+    play.add_argument("path")
+    play.add_argument("--seek", type=int, default=None)
+    play.add_argument("--watch", action="store_true")
+    play.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        game = TetrisGame(seed=args.seed, randomizer=args.randomizer)
+        with open(args.path, "wb") as f:
+            recorder = ReplayRecorder(f, game)
+            runner = HeadlessRunner(game, RandomInput(args.seed))
+            runner.run(args.max_ticks)
+            recorder.close()
+        print(f"recorded {runner.ticks} ticks, score {game.score_manager.score}")
+        return
+
+    player = ReplayPlayer.load(args.path)
+    if args.seek is not None:
+        start = time.perf_counter()
+        player.seek(args.seek)
+        print(f"seek to tick {args.seek} in {(time.perf_counter() - start) * 1000:.2f} ms")
+    if args.watch:
+        player.watch(args.speed)
+    else:
+        rate = player.play()
+        print(f"played {player.length} ticks at {rate:,.0f} ticks/s, score {player.game.score_manager.score}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from final_game import Piece, ACTION_LEFT, ACTION_RIGHT, ACTION_DOWN, ACTION_ROTATE, ACTION_DROP
+
+TT_CAPACITY = 1 << 16
+
+
+def position_key(grid, piece, rotation=None, x=None, y=None):
+    return (grid.hash, grid.width, grid.height, piece.shape_idx,
+            piece.rotation if rotation is None else rotation,
+            piece.x if x is None else x,
+            piece.y if y is None else y)
+
+
+class TranspositionTable:
+    POLICIES = ("depth", "lru")
+
+    def __init__(self, capacity=TT_CAPACITY, policy="depth"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown replacement policy: {policy}")
+        if policy == "depth" and capacity & (capacity - 1):
+            raise ValueError("Depth-preferred tables need a power-of-two capacity")
+        self.capacity = capacity
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        if self.policy == "depth":
+            self._slots = [None] * self.capacity
+        else:
+            self._entries = OrderedDict()
+
+    def get(self, key, depth=0):
+        if self.policy == "depth":
+            entry = self._slots[hash(key) & (self.capacity - 1)]
+            if entry is not None and entry[0] == key and entry[1] >= depth:
+                self.hits += 1
+                return entry[2]
+        else:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= depth:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, key, value, depth=0):
+        if self.policy == "depth":
+            slot = hash(key) & (self.capacity - 1)
+            entry = self._slots[slot]
+            if entry is None or entry[0] == key or depth >= entry[1]:
+                self._slots[slot] = (key, depth, value)
+        else:
+            self._entries[key] = (depth, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        if self.policy == "depth":
+            return sum(entry is not None for entry in self._slots)
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+Placement = namedtuple("Placement", "rotation x y path")
+
+
+ROTATION_PERIODS = tuple(next(period for period in (1, 2, 4)
+                              if period == 4 or np.array_equal(states[period].shape, states[0].shape))
+                         for states in Piece.ROTATIONS)
+MAX_PIECE_HEIGHT = max(state.height for states in Piece.ROTATIONS for state in states)
+_FREE_BYTES = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def free_map(grid, shape_idx, top=0):
+    # One bit per (row, column) with a blocked wall column after each row and blocked floor rows
+    # below, so a state's collisions are the OR of the board shifted by each of the piece's cells.
+    width = grid.width
+    stride = width + 1
+    height = grid.height - top
+    occupied = np.ones((height + MAX_PIECE_HEIGHT, stride), dtype=bool)
+    occupied[:height, :width] = grid.region(top, grid.height) != 0
+    board = int.from_bytes(np.packbits(occupied, bitorder="little").tobytes(), "little")
+    size = (height + 1) * stride
+    mask = (1 << size) - 1
+    layers = []
+    for state in Piece.ROTATIONS[shape_idx][:ROTATION_PERIODS[shape_idx]]:
+        blocked = 0
+        for dx, dy in state.cells:
+            blocked |= board >> dy * stride + dx
+        layers.append(format(~blocked & mask, f"0{size}b")[::-1])
+    return "".join(layers).encode().translate(_FREE_BYTES)
+
+
+_placement_cache = TranspositionTable(policy="lru")
+
+
+def enumerate_placements(grid, piece, table=_placement_cache):
+    key = position_key(grid, piece)
+    if table is not None:
+        placements = table.get(key)
+        if placements is not None:
+            return placements
+
+    # Rows above `top` are open air for every orientation, so the search starts on the first row that
+    # can touch the stack and the fall through the air is spliced back into the paths as DOWN moves.
+    stride = grid.width + 1
+    top = max(grid.top - MAX_PIECE_HEIGHT, 0)
+    fall = max(top - piece.y, 0)
+    free = free_map(grid, piece.shape_idx, top)
+    states = len(free)
+    layer = states // ROTATION_PERIODS[piece.shape_idx]
+    start = piece.rotation % ROTATION_PERIODS[piece.shape_idx] * layer + (piece.y + fall - top) * stride + piece.x
+    if not free[start]:
+        return ()
+    parents = [-1] * states
+    moves = [0] * states
+    parents[start] = start
+    level = [start]
+    landings = []
+    while level:
+        below = []
+        for state in level:
+            if free[state - 1] and parents[state - 1] < 0:
+                parents[state - 1] = state
+                moves[state - 1] = ACTION_LEFT
+                level.append(state - 1)
+            if free[state + 1] and parents[state + 1] < 0:
+                parents[state + 1] = state
+                moves[state + 1] = ACTION_RIGHT
+                level.append(state + 1)
+            rotated = (state + layer) % states
+            if free[rotated] and parents[rotated] < 0:
+                parents[rotated] = state
+                moves[rotated] = ACTION_ROTATE
+                level.append(rotated)
+            if not free[state + stride]:
+                landings.append(state)
+            elif parents[state + stride] < 0:
+                parents[state + stride] = state
+                moves[state + stride] = ACTION_DOWN
+                below.append(state + stride)
+        level = below
+
+    placements = []
+    for state in landings:
+        rotation, rest = divmod(state, layer)
+        y, x = divmod(rest, stride)
+        while state != start and moves[state] == ACTION_DOWN:
+            state = parents[state]
+        path = []
+        while state != start:
+            path.append(moves[state])
+            state = parents[state]
+        path.reverse()
+        if fall and ACTION_DOWN in path:
+            turn = path.index(ACTION_DOWN)
+            path[turn:turn] = [ACTION_DOWN] * fall
+        path.append(ACTION_DROP)
+        placements.append(Placement(rotation, x, y + top, tuple(path)))
+    placements = tuple(placements)
+
+    if table is not None:
+        table.put(key, placements)
+    return placements
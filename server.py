@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import random
+import sys
+import time
+
+import numpy as np
+
+from final_game import (TetrisGame, ACTION_LEFT, ACTION_RIGHT, ACTION_DOWN, ACTION_ROTATE,
+                        ACTION_DROP, ACTION_GRAVITY, ACTION_RESET)
+
+COMMANDS = {
+    b"L": ACTION_LEFT,
+    b"R": ACTION_RIGHT,
+    b"D": ACTION_DOWN,
+    b"U": ACTION_ROTATE,
+    b"S": ACTION_DROP,
+    b"N": ACTION_RESET,
+}
+FLUSH_INTERVAL = 1 / 60
+LINE_LIMIT = 1 << 12
+WRITE_BUFFER_LIMIT = 1 << 16
+STALL_TIMEOUT = 10.0
+REPORT_INTERVAL = 5.0
+LATENCY_WINDOW = 1 << 16
+
+
+class Session:
+    def __init__(self, game, writer):
+        self.game = game
+        self.writer = writer
+        self.generation = 0
+        self.closed = False
+        self.stalled = None
+        self._top = game.grid.height
+        self._region = np.zeros((0, game.grid.width), dtype=np.uint8)
+        self._version = None
+        self._piece = None
+        self._status = None
+
+    def delta(self):
+        game = self.game
+        parts = []
+        grid = game.grid
+        if grid.version != self._version:
+            top = grid.top
+            start = min(top, self._top)
+            rows = grid.region(start, grid.height)
+            previous = np.zeros_like(rows)
+            previous[self._top - start:] = self._region
+            for row in np.flatnonzero((rows != previous).any(axis=1)).tolist():
+                parts.append(b"B %d %s\n" % (start + row, bytes(rows[row].astype(np.uint8) + 48)))
+            self._top = top
+            self._region = rows[top - start:].copy()
+            self._version = grid.version
+        piece = game.current_piece
+        state = (piece.shape_idx, piece.rotation, piece.x, piece.y)
+        if state != self._piece:
+            parts.append(b"P %d %d %d %d\n" % state)
+            self._piece = state
+        score = game.score_manager
+        status = (score.score, score.level, score.lines_cleared, game.next_piece.shape_idx, game.game_over)
+        if status != self._status:
+            parts.append(b"S %d %d %d %d %d\n" % status)
+            self._status = status
+        return b"".join(parts)
+
+
+class GameServer:
+    def __init__(self, seed=0):
+        self.seeds = itertools.count(seed)
+        self.sessions = set()
+        self.dirty = set()
+        self.heap = []
+        self.order = itertools.count()
+        self.ticks = 0
+        self.lateness = np.zeros(LATENCY_WINDOW)
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+
+    def _schedule(self, session, now):
+        delay = session.game.score_manager.get_fall_delay() / 1000
+        heapq.heappush(self.heap, (now + delay, next(self.order), session.generation, session))
+
+    async def handle(self, reader, writer):
+        game = TetrisGame(seed=next(self.seeds))
+        game.game_state = "playing"
+        session = Session(game, writer)
+        self.sessions.add(session)
+        writer.write(b"HELLO %d %d %d\n" % (game.sequence.seed, game.grid.width, game.grid.height))
+        self._schedule(session, time.perf_counter())
+        self.dirty.add(session)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for command in line.split():
+                    action = COMMANDS.get(command)
+                    if action is None:
+                        continue
+                    if game.game_over and action != ACTION_RESET:
+                        continue
+                    was_over = game.game_over
+                    game.apply_action(action)
+                    if was_over and not game.game_over:
+                        session.generation += 1
+                        self._schedule(session, time.perf_counter())
+                    self.dirty.add(session)
+        except (ConnectionError, ValueError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            session.closed = True
+            self.sessions.discard(session)
+            self.dirty.discard(session)
+            writer.close()
+
+    def _flush(self, now):
+        behind = set()
+        for session in self.dirty:
+            if session.closed:
+                continue
+            transport = session.writer.transport
+            if transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+                if session.stalled is None:
+                    session.stalled = now
+                elif now - session.stalled > STALL_TIMEOUT:
+                    session.closed = True
+                    transport.abort()
+                    continue
+                behind.add(session)
+                continue
+            session.stalled = None
+            data = session.delta()
+            if data:
+                session.writer.write(data)
+        self.dirty = behind
+
+    async def schedule(self):
+        heap = self.heap
+        next_flush = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            while heap and heap[0][0] <= now:
+                deadline, _, generation, session = heapq.heappop(heap)
+                if session.closed or generation != session.generation or session.game.game_over:
+                    continue
+                self.lateness[self.ticks % LATENCY_WINDOW] = now - deadline
+                self.ticks += 1
+                session.game.apply_action(ACTION_GRAVITY)
+                self.dirty.add(session)
+                if not session.game.game_over:
+                    self._schedule(session, deadline)
+            if now >= next_flush:
+                self._flush(now)
+                next_flush += FLUSH_INTERVAL
+                if next_flush < now:
+                    next_flush = now + FLUSH_INTERVAL
+            wake = min(heap[0][0], next_flush) if heap else next_flush
+            await asyncio.sleep(max(wake - time.perf_counter(), 0))
+
+    def report(self):
+        wall = time.perf_counter() - self.started
+        cpu = time.process_time() - self.cpu_started
+        samples = self.lateness[:min(self.ticks, LATENCY_WINDOW)] * 1000
+        p50, p95, p99 = np.percentile(samples, (50, 95, 99)) if len(samples) else (0.0, 0.0, 0.0)
+        load = cpu / wall if wall else 0.0
+        return {
+            "sessions": len(self.sessions),
+            "ticks_per_second": self.ticks / wall if wall else 0.0,
+            "cpu_load": load,
+            "sessions_per_core": len(self.sessions) / load if load else 0.0,
+            "tick_latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+        }
+
+    async def reporter(self, interval=REPORT_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.report()
+            latency = stats["tick_latency_ms"]
+            print(f"{stats['sessions']} sessions, {stats['ticks_per_second']:,.0f} gravity ticks/s, "
+                  f"cpu {stats['cpu_load']:.0%}, ~{stats['sessions_per_core']:,.0f} sessions/core, "
+                  f"tick latency p50 {latency['p50']:.2f} p95 {latency['p95']:.2f} p99 {latency['p99']:.2f} ms",
+                  flush=True)
+            self.started = time.perf_counter()
+            self.cpu_started = time.process_time()
+            self.ticks = 0
+
+
+async def serve(host, port, seed=0, report=REPORT_INTERVAL):
+    server = GameServer(seed)
+    listener = await asyncio.start_server(server.handle, host, port, limit=LINE_LIMIT)
+    print(f"listening on {listener.sockets[0].getsockname()[:2]}", flush=True)
+    await asyncio.gather(server.schedule(), server.reporter(report), listener.serve_forever())
+
+
+async def _client(host, port, seconds, rate, seed, totals):
+    reader, writer = await asyncio.open_connection(host, port)
+    rng = random.Random(seed)
+    commands = list(COMMANDS)
+
+    async def receive():
+        while True:
+            data = await reader.read(1 << 16)
+            if not data:
+                return
+            totals["bytes"] += len(data)
+
+    receiving = asyncio.ensure_future(receive())
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(rng.expovariate(rate))
+        writer.write(rng.choice(commands) + b"\n")
+        totals["commands"] += 1
+    writer.close()
+    receiving.cancel()
+
+
+async def run_clients(host, port, count, seconds, rate, seed=0):
+    totals = {"bytes": 0, "commands": 0}
+    clients = []
+    for index in range(count):
+        clients.append(asyncio.ensure_future(_client(host, port, seconds, rate, seed + index, totals)))
+        if index % 100 == 99:
+            await asyncio.sleep(0)
+    await asyncio.gather(*clients, return_exceptions=True)
+    print(f"{count} clients sent {totals['commands']:,} commands, received {totals['bytes']:,} bytes", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many Tetris sessions over TCP.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=7777)
+    serve_parser.add_argument("--seed", type=int, default=0)
+    serve_parser.add_argument("--report", type=float, default=REPORT_INTERVAL)
+    clients_parser = commands.add_parser("clients")
+    clients_parser.add_argument("--host", default="127.0.0.1")
+    clients_parser.add_argument("--port", type=int, default=7777)
+    clients_parser.add_argument("--count", type=int, default=1000)
+    clients_parser.add_argument("--seconds", type=float, default=30.0)
+    clients_parser.add_argument("--rate", type=float, default=4.0, help="commands per second per client")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "serve":
+            asyncio.run(serve(args.host, args.port, args.seed, args.report))
+        else:
+            asyncio.run(run_clients(args.host, args.port, args.count, args.seconds, args.rate))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
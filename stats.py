@@ -0,0 +1,225 @@
+import json
+import math
+
+import numpy as np
+
+PIECE_NAMES = "IJLOSTZ"
+CLEAR_NAMES = ("single", "double", "triple", "tetris")
+COMPRESSION = 100
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2,
+                "min": self.min if self.count else None, "max": self.max if self.count else None}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count, stats.mean, stats.m2 = data["count"], data["mean"], data["m2"]
+        if stats.count:
+            stats.min, stats.max = data["min"], data["max"]
+        return stats
+
+
+class QuantileSketch:
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer = []
+
+    def add(self, value):
+        self._buffer.append(value)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def _compress(self, means=None, weights=None):
+        if not self._buffer and means is None:
+            return
+        values = [self.means, np.asarray(self._buffer, dtype=float)]
+        counts = [self.weights, np.ones(len(self._buffer))]
+        if means is not None:
+            values.append(means)
+            counts.append(weights)
+        self._buffer = []
+        values = np.concatenate(values)
+        counts = np.concatenate(counts)
+        if not len(values):
+            return
+        order = np.argsort(values, kind="stable")
+        values, counts = values[order].tolist(), counts[order].tolist()
+        total = sum(counts)
+        scale = self.compression / (2 * math.pi)
+
+        merged_means, merged_weights = [values[0]], [counts[0]]
+        seen = 0.0
+        k_left = -scale * math.pi / 2
+        for value, weight in zip(values[1:], counts[1:]):
+            q = min((seen + merged_weights[-1] + weight) / total, 1.0)
+            if scale * math.asin(2 * q - 1) - k_left <= 1:
+                merged_weights[-1] += weight
+                merged_means[-1] += (value - merged_means[-1]) * weight / merged_weights[-1]
+            else:
+                seen += merged_weights[-1]
+                k_left = scale * math.asin(2 * seen / total - 1)
+                merged_means.append(value)
+                merged_weights.append(weight)
+        self.means = np.array(merged_means)
+        self.weights = np.array(merged_weights)
+        self.count = int(round(total))
+
+    def merge(self, other):
+        other._compress()
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(other.means, other.weights)
+
+    def quantile(self, q):
+        self._compress()
+        if not self.count:
+            return None
+        if len(self.means) == 1:
+            return float(self.means[0])
+        cumulative = np.cumsum(self.weights) - self.weights / 2
+        rank = q * self.count
+        if rank <= cumulative[0]:
+            return float(self.min + (self.means[0] - self.min) * rank / cumulative[0])
+        if rank >= cumulative[-1]:
+            tail = self.count - cumulative[-1]
+            return float(self.means[-1] + (self.max - self.means[-1]) * (rank - cumulative[-1]) / tail)
+        return float(np.interp(rank, cumulative, self.means))
+
+    def to_dict(self):
+        self._compress()
+        return {"compression": self.compression, "min": self.min if self.count else None,
+                "max": self.max if self.count else None,
+                "centroids": [[float(m), float(w)] for m, w in zip(self.means, self.weights)]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["compression"])
+        if data["centroids"]:
+            centroids = np.array(data["centroids"], dtype=float)
+            sketch.means, sketch.weights = centroids[:, 0], centroids[:, 1]
+            sketch.count = int(sketch.weights.sum())
+            sketch.min, sketch.max = data["min"], data["max"]
+        return sketch
+
+
+class GameStats:
+    SUMMARIES = ("score", "lines", "level", "pieces")
+    SKETCHED = ("score", "lines", "pieces")
+
+    def __init__(self, compression=COMPRESSION):
+        self.games = 0
+        self.summaries = {name: RunningStats() for name in self.SUMMARIES}
+        self.sketches = {name: QuantileSketch(compression) for name in self.SKETCHED}
+        self.levels = {}
+        self.clears = [0] * len(CLEAR_NAMES)
+        self.pieces = [0] * len(PIECE_NAMES)
+        self._placed = 0
+
+    def record_placement(self, shape_idx, cleared):
+        self.pieces[shape_idx] += 1
+        if cleared:
+            self.clears[cleared - 1] += 1
+        self._placed += 1
+
+    def record_game(self, score_manager):
+        values = {"score": score_manager.score, "lines": score_manager.lines_cleared,
+                  "level": score_manager.level, "pieces": self._placed}
+        for name, summary in self.summaries.items():
+            summary.add(values[name])
+        for name, sketch in self.sketches.items():
+            sketch.add(values[name])
+        self.levels[score_manager.level] = self.levels.get(score_manager.level, 0) + 1
+        self.games += 1
+        self._placed = 0
+
+    def merge(self, other):
+        self.games += other.games
+        for name, summary in self.summaries.items():
+            summary.merge(other.summaries[name])
+        for name, sketch in self.sketches.items():
+            sketch.merge(other.sketches[name])
+        for level, count in other.levels.items():
+            self.levels[level] = self.levels.get(level, 0) + count
+        self.clears = [a + b for a, b in zip(self.clears, other.clears)]
+        self.pieces = [a + b for a, b in zip(self.pieces, other.pieces)]
+
+    def to_dict(self):
+        return {
+            "games": self.games,
+            "summaries": {name: summary.to_dict() for name, summary in self.summaries.items()},
+            "sketches": {name: sketch.to_dict() for name, sketch in self.sketches.items()},
+            "levels": {str(level): count for level, count in sorted(self.levels.items())},
+            "clears": self.clears,
+            "pieces": self.pieces,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.games = data["games"]
+        stats.summaries = {name: RunningStats.from_dict(value) for name, value in data["summaries"].items()}
+        stats.sketches = {name: QuantileSketch.from_dict(value) for name, value in data["sketches"].items()}
+        stats.levels = {int(level): count for level, count in data["levels"].items()}
+        stats.clears = list(data["clears"])
+        stats.pieces = list(data["pieces"])
+        return stats
+
+    def report(self):
+        report = {"games": self.games}
+        for name, summary in self.summaries.items():
+            entry = {"mean": round(summary.mean, 3), "std": round(math.sqrt(summary.variance), 3),
+                     "min": summary.min if summary.count else None, "max": summary.max if summary.count else None}
+            if name in self.sketches:
+                for q in QUANTILES:
+                    value = self.sketches[name].quantile(q)
+                    entry[f"p{round(q * 100)}"] = None if value is None else round(value, 1)
+            report[name] = entry
+        report["levels"] = {str(level): count for level, count in sorted(self.levels.items())}
+        report["line_clears"] = dict(zip(CLEAR_NAMES, self.clears))
+        placed = sum(self.pieces)
+        report["piece_frequency"] = {name: round(count / placed, 4) if placed else 0.0
+                                     for name, count in zip(PIECE_NAMES, self.pieces)}
+        return report
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), **kwargs)
@@ -0,0 +1,193 @@
+import io
+
+import numpy as np
+import pytest
+
+from autoplay import AutoPlayer
+from batch_sim import BatchSimulator
+from final_game import (COLS, ROWS, GRID_BACKENDS, Grid, PieceSequence, TetrisGame, ACTION_DOWN, ACTION_DROP,
+                        ACTION_LEFT, ACTION_RESET, ACTION_RIGHT, ACTION_ROTATE)
+from headless import HeadlessRunner, RandomInput
+from replay import ReplayPlayer, ReplayRecorder
+from search import ROTATION_PERIODS, enumerate_placements
+
+
+class ActionLog:
+    def __init__(self):
+        self.actions = []
+
+    def record(self, action):
+        self.actions.append(action)
+
+    def advance(self):
+        pass
+
+
+def played_actions(seed, width, height, ticks=3000):
+    game = TetrisGame(seed=seed, width=width, height=height)
+    game.player = AutoPlayer(budget_ms=0.0, actions_per_frame=None, auto_restart=True)
+    game.recorder = log = ActionLog()
+    HeadlessRunner(game).run(ticks)
+    return log.actions
+
+
+def brute_force_landings(grid, piece):
+    period = ROTATION_PERIODS[piece.shape_idx]
+    start = (piece.rotation, piece.x, piece.y)
+    seen = {start}
+    frontier = [start]
+    landings = set()
+    while frontier:
+        rotation, x, y = frontier.pop()
+        if not grid.is_valid_position(piece, rotation, x, y + 1):
+            landings.add((rotation % period, x, y))
+        for state in ((rotation, x - 1, y), (rotation, x + 1, y), ((rotation + 1) % 4, x, y), (rotation, x, y + 1)):
+            if state not in seen and grid.is_valid_position(piece, *state):
+                seen.add(state)
+                frontier.append(state)
+    return landings
+
+
+def rehashed(grid):
+    reference = Grid(grid.width, grid.height)
+    reference.load(grid.cells)
+    return reference
+
+
+@pytest.mark.parametrize("width, height", [(COLS, ROWS), (12, 30)])
+def test_grid_backends_agree(width, height):
+    actions = played_actions(7, width, height)
+    games = {name: TetrisGame(cls, seed=7, width=width, height=height) for name, cls in GRID_BACKENDS.items()}
+    reference = games.pop("array")
+    for step, action in enumerate(actions):
+        reference.apply_action(action)
+        for name, game in games.items():
+            game.apply_action(action)
+            assert game.grid.hash == reference.grid.hash, (name, step)
+            assert game.grid.heights == reference.grid.heights, (name, step)
+        if step % 25 == 0:
+            for name, game in games.items():
+                assert np.array_equal(game.grid.cells, reference.grid.cells), (name, step)
+    assert reference.score_manager.lines_cleared > 0
+
+
+@pytest.mark.parametrize("backend", sorted(GRID_BACKENDS))
+def test_incremental_hash_matches_rehash(backend):
+    game = TetrisGame(GRID_BACKENDS[backend], seed=11)
+    for step, action in enumerate(played_actions(11, COLS, ROWS)):
+        game.apply_action(action)
+        if step % 10 == 0:
+            reference = rehashed(game.grid)
+            assert game.grid.hash == reference.hash, step
+            assert game.grid.heights == reference.heights, step
+
+
+def test_batch_simulator_matches_game():
+    boards, steps = 16, 600
+    rng = np.random.default_rng(3)
+    weights = np.ones(ACTION_RESET + 1)
+    weights[ACTION_RESET] = 0.05
+    actions = rng.choice(ACTION_RESET + 1, size=(steps, boards), p=weights / weights.sum())
+    sim = BatchSimulator(boards, seeds=range(boards))
+    games = [TetrisGame(seed=seed) for seed in range(boards)]
+    for step, step_actions in enumerate(actions):
+        cleared, done = sim.step(step_actions)
+        for i, (game, action) in enumerate(zip(games, step_actions.tolist())):
+            lines = game.score_manager.lines_cleared
+            game.apply_action(action)
+            if action != ACTION_RESET:
+                assert cleared[i] == game.score_manager.lines_cleared - lines, (i, step)
+            assert done[i] == game.game_over, (i, step)
+            if game.game_over:
+                game.reset()
+            piece = game.current_piece
+            assert np.array_equal(sim.boards[i], game.grid.cells), (i, step)
+            assert (sim.shape[i], sim.rotation[i], sim.x[i], sim.y[i]) == (
+                piece.shape_idx, piece.rotation, piece.x, piece.y), (i, step)
+            assert sim.next_shape[i] == game.next_piece.shape_idx, (i, step)
+            score = game.score_manager
+            assert (sim.score[i], sim.level[i], sim.lines_cleared[i]) == (
+                score.score, score.level, score.lines_cleared), (i, step)
+    assert sim.games_finished.sum() > 0
+
+
+def test_batch_draws_follow_piece_sequence():
+    sim = BatchSimulator(3, seeds=range(3), randomizer="bag")
+    draws = 2 * sim.chunk + 5
+    drawn = np.stack([sim._draw(np.arange(3)) for _ in range(draws)], axis=1)
+    for seed, shapes in enumerate(drawn):
+        sequence = PieceSequence(seed, "bag")
+        for _ in range(2):
+            sequence.next()
+        assert shapes.tolist() == [sequence.next() for _ in range(draws)]
+
+
+@pytest.mark.parametrize("backend", sorted(GRID_BACKENDS))
+def test_hash_separates_rows_far_apart(backend):
+    grid = GRID_BACKENDS[backend](COLS, 200)
+    cells = np.zeros((200, COLS), dtype=np.uint8)
+    hashes = set()
+    for rows in ([100], [36, 100], [100, 164], [36, 164]):
+        cells[:] = 0
+        cells[rows, 3] = 1
+        grid.load(cells)
+        hashes.add(grid.hash)
+    assert len(hashes) == 4
+
+
+def test_replay_seek_matches_playback():
+    game = TetrisGame(seed=5)
+    game.game_state = "playing"
+    stream = io.BytesIO()
+    recorder = ReplayRecorder(stream, game, keyframe_interval=200)
+    inputs = RandomInput(5, 0.6)
+    for tick in range(3000):
+        for action in inputs(game, tick):
+            if not game.game_over:
+                game.apply_action(action)
+        if game.game_over:
+            game.apply_action(ACTION_RESET)
+        game.update(16)
+        recorder.advance()
+    recorder.close()
+    data = stream.getvalue()
+    seeking = ReplayPlayer(data)
+    for tick in range(0, 3000, 37):
+        playing = ReplayPlayer(data)
+        playing.advance_to(tick)
+        seeking.advance_to(2999)
+        seeking.seek(tick)
+        assert seeking.game.snapshot() == playing.game.snapshot(), tick
+
+
+@pytest.mark.parametrize("width, height", [(COLS, ROWS), (12, 30)])
+def test_placements_match_brute_force(width, height):
+    game = TetrisGame(seed=13, width=width, height=height)
+    probe = TetrisGame(seed=13, width=width, height=height)
+    checked = 0
+    for step, action in enumerate(played_actions(13, width, height)):
+        game.apply_action(action)
+        if step % 40 or game.game_over:
+            continue
+        piece = game.current_piece
+        placements = enumerate_placements(game.grid, piece, table=None)
+        assert {(p.rotation, p.x, p.y) for p in placements} == brute_force_landings(game.grid, piece), step
+        snapshot = game.snapshot()
+        for placement in placements:
+            probe.restore(snapshot)
+            assert placement.path[-1] == ACTION_DROP
+            for move in placement.path[:-1]:
+                assert move in (ACTION_LEFT, ACTION_RIGHT, ACTION_ROTATE, ACTION_DOWN)
+                probe.apply_action(move)
+            landed = probe.current_piece
+            landing = (landed.rotation % ROTATION_PERIODS[landed.shape_idx], landed.x,
+                       landed.y + probe.grid.drop_distance(landed))
+            assert landing == (placement.rotation, placement.x, placement.y), (step, placement)
+            color = landed.shape_idx + 1
+            cells = [(landed.x + dx, landing[2] + dy) for dx, dy in landed.state.cells]
+            lines = probe.score_manager.lines_cleared
+            probe.apply_action(ACTION_DROP)
+            if probe.score_manager.lines_cleared == lines:
+                assert all(probe.grid.cells[y, x] == color for x, y in cells), (step, placement)
+            checked += 1
+    assert checked > 0